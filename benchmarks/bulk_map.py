@@ -0,0 +1,46 @@
+"""
+Measure the throughput of RestAPI.map against the fake slack server, for several
+concurrency limits.
+
+The server answers users.info after a fixed latency, to stand for the round trip to slack.
+The rate limiter is disabled, so only the concurrency limit paces the calls.
+
+    python -m benchmarks.bulk_map
+"""
+import time
+
+import tornado.gen
+import tornado.ioloop
+
+from benchmarks.fake_slack import FakeSlackServer
+
+CALLS = 500
+LATENCY = 0.02 # seconds
+CONCURRENCY = (1, 5, 10, 25, 50)
+
+
+@tornado.gen.coroutine
+def main():
+    server = FakeSlackServer(users=CALLS, latency=LATENCY)
+    server.start()
+    slack = server.client(max_concurrency=max(CONCURRENCY))
+    users_info = slack.api.users.info
+
+    print("{0} calls, {1:.0f}ms latency".format(CALLS, LATENCY * 1000))
+    print("{0:>12}{1:>14}{2:>10}".format("concurrency", "requests/s", "errors"))
+    for concurrency in CONCURRENCY:
+        params_list = ({ "user": "U{0:08d}".format(i) } for i in range(CALLS))
+        start = time.monotonic()
+        errors = 0
+        results = users_info.map(params_list, concurrency=concurrency)
+        result = yield results.fetch_next()
+        while result is not None:
+            errors += 0 if result.ok else 1
+            result = yield results.fetch_next()
+        elapsed = time.monotonic() - start
+        print("{0:>12}{1:>14,.0f}{2:>10}".format(concurrency, CALLS / elapsed, errors))
+    server.stop()
+
+
+if __name__ == "__main__":
+    tornado.ioloop.IOLoop.current().run_sync(main)
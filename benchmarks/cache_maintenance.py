@@ -0,0 +1,101 @@
+"""
+Compare the cost of keeping slackbot.cache.Cache up to date for one hour by
+    - reloading everything every 60 minutes (autofetch)
+    - applying the rtm events as they come, with a daily consistency sweep (watch)
+
+The api is replaced by in memory pages, so the CPU time only includes the work done by
+the cache, not the network nor the json parsing (which both favour watch even more).
+
+    python -m benchmarks.cache_maintenance
+"""
+import math
+import time
+import types
+
+import tornado.gen
+import tornado.ioloop
+
+from slacktor.slackbot.cache import Cache
+
+USERS = 60000
+CHANNELS = 5000
+PAGE_SIZE = 200
+# events per hour in a busy workspace
+USER_CHANGES = 300
+TEAM_JOINS = 20
+CHANNEL_EVENTS = 30
+
+
+class FakePages(object):
+
+    def __init__(self, key, items, page_size):
+        self.key = key
+        self.items = items
+        self.page_size = page_size
+        self.offset = 0
+        self.calls = 0
+
+    @tornado.gen.coroutine
+    def fetch_next(self):
+        if self.offset >= len(self.items):
+            return None
+        page = self.items[self.offset:self.offset + self.page_size]
+        self.offset += self.page_size
+        FakeSlack.calls += 1
+        data = types.SimpleNamespace(ok=True, **{ self.key: page })
+        return types.SimpleNamespace(code=200, data=data)
+
+
+class FakeSlack(object):
+
+    calls = 0
+
+    def __init__(self):
+        users = [ { "id": "U{0:08d}".format(index), "name": "user{0}".format(index) } for index in range(USERS) ]
+        channels = [ { "id": "C{0:08d}".format(index), "name": "channel{0}".format(index), "is_member": index % 10 == 0 }
+                for index in range(CHANNELS) ]
+        list_users = types.SimpleNamespace(pages=lambda limit, **kwargs: FakePages("members", users, limit))
+        list_channels = types.SimpleNamespace(pages=lambda limit, **kwargs: FakePages("channels", channels, limit))
+        self.api = types.SimpleNamespace(users=types.SimpleNamespace(list=list_users),
+                channels=types.SimpleNamespace(list=list_channels))
+
+
+def hour_of_events():
+    events = []
+    for index in range(USER_CHANGES):
+        events.append(("user_change", { "type": "user_change", "user": { "id": "U{0:08d}".format(index), "name": "renamed{0}".format(index) } }))
+    for index in range(TEAM_JOINS):
+        events.append(("team_join", { "type": "team_join", "user": { "id": "UN{0:07d}".format(index), "name": "new{0}".format(index) } }))
+    for index in range(CHANNEL_EVENTS):
+        channel = { "id": "CN{0:07d}".format(index), "name": "new-channel{0}".format(index) }
+        events.append(("channel_created", { "type": "channel_created", "channel": channel }))
+    return events
+
+
+def main():
+    cache = Cache(FakeSlack())
+    io_loop = tornado.ioloop.IOLoop.current()
+
+    start = time.process_time()
+    FakeSlack.calls = 0
+    io_loop.run_sync(lambda: cache.fetch_all())
+    reload_cpu = time.process_time() - start
+    reload_calls = FakeSlack.calls
+
+    events = hour_of_events()
+    start = time.process_time()
+    for event_name, event in events:
+        getattr(cache, Cache.EVENT_HANDLERS[event_name])(event)
+    events_cpu = time.process_time() - start
+
+    sweeps_per_hour = 60.0 / Cache.CONSISTENCY_SWEEP_DELAY
+    print("workspace: {0} users, {1} channels, {2} events/hour".format(USERS, CHANNELS, len(events)))
+    print("{0:<32} {1:>12} {2:>14}".format("mode", "api calls/h", "cpu ms/h"))
+    print("{0:<32} {1:>12.1f} {2:>14.2f}".format("autofetch every 60 minutes", reload_calls, reload_cpu * 1000))
+    print("{0:<32} {1:>12.1f} {2:>14.2f}".format("watch + daily sweep", reload_calls * sweeps_per_hour,
+        (events_cpu + reload_cpu * sweeps_per_hour) * 1000))
+    assert reload_calls == math.ceil(USERS / PAGE_SIZE) + math.ceil(CHANNELS / PAGE_SIZE)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Compare the memory used to keep 100k users in slackbot.cache by
+    - the two name/id dicts the cache used to keep (only the names, no other lookup)
+    - the raw users.list members, with dicts indexing them by name, display name and email
+    - slackbot.directory, with the same indexes and a prefix search
+
+    python -m benchmarks.directory_memory
+"""
+import gc
+import tracemalloc
+
+from slacktor.slackbot.directory import UserRecord, user_directory
+
+USERS = 100000
+
+
+def make_members():
+    return [ {
+        "id": "U{0:08d}".format(i),
+        "name": "user{0}".format(i),
+        "deleted": False,
+        "is_bot": False,
+        "real_name": "User Number {0}".format(i),
+        "profile": {
+            "real_name": "User Number {0}".format(i),
+            "display_name": "User {0}".format(i),
+            "email": "user{0}@example.com".format(i),
+        },
+    } for i in range(USERS) ]
+
+
+def name_dicts(members):
+    user_name_to_id = {}
+    user_id_to_name = {}
+    for member in members:
+        user_name_to_id[member["name"]] = member["id"]
+        user_id_to_name[member["id"]] = member["name"]
+    return user_name_to_id, user_id_to_name
+
+
+def member_dicts(members):
+    by_id = {}
+    by_name = {}
+    by_display_name = {}
+    by_email = {}
+    for member in members:
+        by_id[member["id"]] = member
+        by_name[member["name"]] = member
+        by_display_name[member["profile"]["display_name"].lower()] = member
+        by_email[member["profile"]["email"].lower()] = member
+    return by_id, by_name, by_display_name, by_email
+
+
+def directory(members):
+    users = user_directory()
+    for member in members:
+        users.add(UserRecord.from_member(member))
+    # build the search index now, so it is measured
+    users.search("user1", limit=1)
+    return users
+
+
+def measure(build):
+    """Measure the memory still held by what build returns, the members are decoded json
+    and are created inside the measurement, like they would be when reading a page."""
+    gc.collect()
+    tracemalloc.start()
+    members = make_members()
+    result = build(members)
+    # the pages are dropped once the cache is filled, unless the cache keeps them
+    del members
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, peak
+
+
+def main():
+    print("{0} users".format(USERS))
+    print("{0:40s}{1:>12s}{2:>12s}".format("storage", "held MB", "peak MB"))
+    for name, build in (
+            ("name/id dicts (names only)", name_dicts),
+            ("member dicts + 4 indexes", member_dicts),
+            ("directory (5 indexes + search)", directory)):
+        current, peak = measure(build)
+        print("{0:40s}{1:12.1f}{2:12.1f}".format(name, current / 2 ** 20, peak / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main()
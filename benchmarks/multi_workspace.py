@@ -0,0 +1,65 @@
+"""
+Measure the cost of serving many workspaces from one process with SlackPool.
+
+    - the time and memory added by each token, with the users.info endpoint created
+    - requests/s of users.info spread over all the tokens, against the fake slack server
+
+    python -m benchmarks.multi_workspace
+    python -m benchmarks.multi_workspace --tokens 1000
+"""
+import gc
+import time
+import argparse
+import tracemalloc
+
+import tornado.ioloop
+
+from slacktor.slack import Slack, SlackPool
+
+from benchmarks.fake_slack import FakeSlackServer
+from benchmarks.suite import run_calls, report
+
+CALLS = 5000
+
+
+async def main(tokens):
+    # compile the definitions before measuring
+    Slack("xoxb-warmup")
+
+    gc.collect()
+    tracemalloc.start()
+    started = time.monotonic()
+    pool = SlackPool(max_concurrency=50)
+    for index in range(tokens):
+        pool.get("xoxb-{0}".format(index)).api.users.info
+    elapsed = time.monotonic() - started
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("{0:,} tokens".format(tokens))
+    print("{0:<40}{1:>12.1f}us  {2:.1f}KB".format("per token", elapsed / tokens * 1e6,
+        current / tokens / 1024))
+
+    server = FakeSlackServer(users=1000)
+    server.start()
+    for token in pool.tokens():
+        for api in pool[token].apis():
+            for endpoint in api.endpoints.values():
+                endpoint.set_host(server.host)
+                endpoint.protocol = "http"
+                endpoint.set_rate_limiter(None)
+    print()
+    print("{0:<40}{1:>12}{2:>10}{3:>10}".format("", "requests/s", "p50 ms", "p99 ms"))
+    clients = [ pool[token].api.users.info for token in pool.tokens() ]
+    elapsed, latencies, errors = await run_calls(
+        lambda i: clients[i % len(clients)](user="U{0:08d}".format(i % 1000)), CALLS, 50)
+    report("users.info over all the tokens", CALLS, elapsed, latencies,
+            "errors: {0}".format(errors) if errors else "")
+    server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=500, help="the number of tokens (default: 500)")
+    args = parser.parse_args()
+    tornado.ioloop.IOLoop.current().run_sync(lambda: main(args.tokens))
@@ -0,0 +1,76 @@
+"""
+Measure how much cpu bound listeners delay the IOLoop, run inline or in the process pool.
+
+A ticker on the IOLoop wakes up every 10ms and records how late it is, which is how late
+the websocket reader and the api calls would be. The same events are dispatched to a
+listener spending about 20ms of CPU per event, registered with and without cpu_bound.
+
+    python -m benchmarks.process_pool
+"""
+import time
+
+import tornado.gen
+import tornado.ioloop
+
+from slacktor.slackbot import SlackBot
+
+from benchmarks.fake_slack import FakeSlackServer
+
+EVENTS = 100
+TICK = 0.01
+
+
+def analyze(event):
+    deadline = time.process_time() + 0.02
+    while time.process_time() < deadline:
+        pass
+    return { "channel": event["channel"], "text": "analyzed" }
+
+
+async def run(server, cpu_bound):
+    bot = SlackBot(server.client(), post_interval=0)
+    if cpu_bound:
+        bot.add_event_listener("message", analyze, cpu_bound=True)
+    else:
+        bot.add_event_listener("message", lambda event: bot.post_message(**analyze(event)))
+    lags = []
+    running = [ True ]
+
+    async def ticker():
+        while running[0]:
+            expected = time.monotonic() + TICK
+            await tornado.gen.sleep(TICK)
+            lags.append(time.monotonic() - expected)
+
+    if cpu_bound:
+        # start the processes before measuring
+        await bot.process_pool.run(time.time)
+    tornado.ioloop.IOLoop.current().spawn_callback(ticker)
+    posted = server.posted
+    started = time.monotonic()
+    for index in range(EVENTS):
+        await bot.dispatch_event({ "type": "message", "channel": "C{0:08d}".format(index % 100),
+            "user": "U00000001", "text": "event {0}".format(index), "ts": server.next_ts() })
+    await bot.dispatcher.join()
+    while server.posted - posted < EVENTS:
+        await tornado.gen.sleep(TICK)
+    elapsed = time.monotonic() - started
+    running[0] = False
+    bot.process_pool.shutdown()
+    lags.sort()
+    print("{0:<30}{1:>10.2f}{2:>12.1f}{3:>12.1f}".format("cpu_bound" if cpu_bound else "inline",
+        elapsed, lags[len(lags) // 2] * 1000 if lags else 0.0, lags[-1] * 1000 if lags else elapsed * 1000))
+
+
+async def main():
+    server = FakeSlackServer(users=100, channels=100)
+    server.start()
+    print("{0} events, 20ms of CPU each".format(EVENTS))
+    print("{0:<30}{1:>10}{2:>12}{3:>12}".format("", "total s", "p50 lag ms", "max lag ms"))
+    await run(server, cpu_bound=False)
+    await run(server, cpu_bound=True)
+    server.stop()
+
+
+if __name__ == "__main__":
+    tornado.ioloop.IOLoop.current().run_sync(main)
@@ -0,0 +1,97 @@
+"""
+Measure the cost of routing a message as the number of routes grows.
+
+RouterExtension is compared with one OnMentionExtension-like regex per route, which is
+what registering one extension per command or keyword amounts to.
+
+The first table grows the commands, keywords and prefixes, with 4 fixed regex routes.
+The second table grows the regex routes: the messages that no regex route can match are
+skipped with a single scan, but each regex route is searched for the other messages, so
+their cost grows linearly with the number of regex routes.
+
+    python -m benchmarks.router
+"""
+import re
+import timeit
+
+from slacktor.slackbot.extensions import RouterExtension
+
+MESSAGES = [
+    "!command42 with some arguments",
+    "hey has anyone seen the keyword17 report? it was due yesterday",
+    ">prefix7 something something",
+    "just a normal message without any route in it, which is the most common case",
+    "JIRA-1234 is fixed, see PR#56",
+]
+
+REGEX_MESSAGES = [
+    "just a normal message without any route in it, which is the most common case",
+    "the build of service42 is broken again",
+]
+
+
+def noop(**kwargs):
+    pass
+
+
+def build_router(number_of_routes):
+    router = RouterExtension()
+    # 4 fixed regexes, the rest split between commands, keywords and prefixes
+    for pattern in (r"JIRA-\d+", r"<https?://[^>]+>", r"\bPR#(\d+)\b", r"^deploy (\w+) to (\w+)$"):
+        router.add_regex(pattern, noop)
+    for index in range(number_of_routes - 4):
+        kind = index % 3
+        if kind == 0:
+            router.add_command("command{0}".format(index // 3), noop)
+        elif kind == 1:
+            router.add_keyword("keyword{0}".format(index // 3), noop)
+        else:
+            router.add_prefix(">prefix{0}".format(index // 3), noop)
+    router.compile()
+    return router
+
+
+def build_regex_router(number_of_routes):
+    router = RouterExtension()
+    for index in range(number_of_routes):
+        router.add_regex(r"\bservice{0}\b".format(index), noop)
+    router.compile()
+    return router
+
+
+def build_naive(number_of_routes):
+    return [ re.compile(r"\b{0}\b".format(re.escape("route{0}".format(index))))
+            for index in range(number_of_routes) ]
+
+
+def compare(build, messages, number, repeat):
+    print("{0:>8} {1:>22} {2:>22}".format("routes", "router (us/message)", "one regex per route"))
+    for number_of_routes in (10, 100, 1000):
+        router = build(number_of_routes)
+        naive = build_naive(number_of_routes)
+
+        def run_router():
+            for text in messages:
+                router.route(text)
+
+        def run_naive():
+            for text in messages:
+                for regex in naive:
+                    regex.search(text)
+
+        router_time = min(timeit.repeat(run_router, number=number, repeat=repeat))
+        naive_time = min(timeit.repeat(run_naive, number=number // 10, repeat=repeat)) * 10
+        per_message = 1e6 / (number * len(messages))
+        print("{0:>8} {1:>22.2f} {2:>22.2f}".format(number_of_routes,
+            router_time * per_message, naive_time * per_message))
+
+
+def main(number=2000, repeat=5):
+    print("commands, keywords and prefixes, 4 regexes")
+    compare(build_router, MESSAGES, number, repeat)
+    print("regexes only, half of the messages match one of them (linear)")
+    compare(build_regex_router, REGEX_MESSAGES, number, repeat)
+
+
+if __name__ == "__main__":
+    main()
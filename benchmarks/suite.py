@@ -0,0 +1,277 @@
+"""
+End to end benchmarks of slacktor against the fake slack server (see fake_slack.py).
+
+    - web api: requests/s and p50/p99 latency of GET and POST calls, with and without
+      injected errors
+    - cache: time and memory to fill slackbot.cache.Cache from a large workspace
+    - rtm: events/s through SlackBot.websocket_watch
+    - events api: events/s pushed to EventsAPIReceiver, 10% of them being retries
+    - startup: import time of slacktor.slack and latency of the first chat.postMessage, in a
+      new interpreter
+
+The client and the server share the same process and CPU, so the numbers are a lower
+bound of what the client can do, and are meant to compare changes, not to be absolute.
+
+    python -m benchmarks.suite
+    python -m benchmarks.suite --quick
+"""
+import gc
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import tracemalloc
+
+import tornado.gen
+import tornado.ioloop
+import tornado.httpclient
+import tornado.httpserver
+import tornado.process
+
+from slacktor.api_wrapper import RetryPolicy
+from slacktor.slackbot import SlackBot
+from slacktor.slackbot.cache import Cache
+from slacktor.slackbot.events_api import EventsAPIReceiver
+
+from benchmarks.fake_slack import FakeSlackServer, signed_event_request
+
+
+def percentile(sorted_values, ratio):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * ratio))]
+
+
+def report(name, count, elapsed, latencies=None, extra=""):
+    latencies = sorted(latencies or [])
+    print("{0:<40}{1:>12,.0f}{2:>10.1f}{3:>10.1f}  {4}".format(name, count / elapsed,
+        percentile(latencies, 0.50) * 1000, percentile(latencies, 0.99) * 1000, extra))
+
+
+@tornado.gen.coroutine
+def run_calls(call, count, concurrency):
+    """Call call(index) count times, with {concurrency} calls in flight
+
+    return              (elapsed, latencies, errors)
+    """
+    latencies = []
+    errors = [ 0 ]
+    indexes = iter(range(count))
+
+    @tornado.gen.coroutine
+    def worker():
+        for index in indexes:
+            started = time.monotonic()
+            try:
+                response = yield call(index)
+                if response.code != 200:
+                    errors[0] += 1
+            except Exception:
+                errors[0] += 1
+            latencies.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    yield [ worker() for _ in range(concurrency) ]
+    return time.monotonic() - started, latencies, errors[0]
+
+
+@tornado.gen.coroutine
+def bench_web_api(calls, latency):
+    print("{0:<40}{1:>12}{2:>10}{3:>10}".format("web api ({0:.0f}ms latency)".format(latency * 1000),
+        "requests/s", "p50 ms", "p99 ms"))
+    server = FakeSlackServer(users=1000, latency=latency)
+    server.start()
+    for concurrency in (1, 10, 50):
+        slack = server.client(max_concurrency=concurrency)
+        users_info = slack.api.users.info
+        elapsed, latencies, errors = yield run_calls(
+            lambda i: users_info(user="U{0:08d}".format(i % 1000)), calls, concurrency)
+        report("users.info, concurrency {0}".format(concurrency), calls, elapsed, latencies,
+                "errors: {0}".format(errors) if errors else "")
+
+    slack = server.client(max_concurrency=10)
+    post_message = slack.api.chat.post_message.set(retries_status=set())
+    elapsed, latencies, errors = yield run_calls(
+        lambda i: post_message(channel="C00000001", text="message {0}".format(i)), calls, 10)
+    report("chat.postMessage, concurrency 10", calls, elapsed, latencies,
+            "errors: {0}".format(errors) if errors else "")
+    server.stop()
+
+    # 5% of 500/503, retried with a short backoff
+    server = FakeSlackServer(users=1000, latency=latency, error_rate=0.05, error_codes=(500, 503))
+    server.start()
+    slack = server.client(max_concurrency=10)
+    users_info = slack.api.users.info.set(retries_status={ 500, 503 }, max_tries=5,
+            retry_policy=RetryPolicy(base_delay=0.01, max_delay=0.1))
+    elapsed, latencies, errors = yield run_calls(
+        lambda i: users_info(user="U{0:08d}".format(i % 1000)), calls, 10)
+    report("users.info, 5% errors, concurrency 10", calls, elapsed, latencies,
+            "injected: {0}, failed: {1}".format(sum(server.injected_errors.values()), errors))
+    server.stop()
+    print()
+
+
+@tornado.gen.coroutine
+def bench_cache(users, channels):
+    server = FakeSlackServer(users=users, channels=channels)
+    server.start()
+    print("cache ({0:,} users, {1:,} channels)".format(users, channels))
+
+    cache = Cache(server.client(max_concurrency=1))
+    started = time.monotonic()
+    yield cache.fetch_all()
+    elapsed = time.monotonic() - started
+    print("{0:<40}{1:>12.2f}s  {2} requests".format("fetch_all", elapsed, sum(server.requests.values())))
+    del cache
+
+    # the json of the pages is only held while a page is read, only the cache remains
+    gc.collect()
+    tracemalloc.start()
+    cache = Cache(server.client(max_concurrency=1))
+    yield cache.fetch_all()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("{0:<40}{1:>12.1f}MB  peak {2:.1f}MB".format("memory held by the cache", current / 2 ** 20,
+        peak / 2 ** 20))
+    server.stop()
+    print()
+
+
+@tornado.gen.coroutine
+def bench_rtm(events):
+    server = FakeSlackServer(users=1000, channels=100, rtm_events=events)
+    server.start()
+    slack = server.client()
+    bot = SlackBot(slack, ping_interval=0, backfill=False)
+    received = [ 0 ]
+    started = [ None ]
+
+    def on_message(event):
+        if started[0] is None:
+            started[0] = time.monotonic()
+        received[0] += 1
+        if received[0] >= events:
+            bot.stop()
+
+    bot.add_event_listener("message", on_message)
+    yield bot.websocket_watch()
+    elapsed = time.monotonic() - started[0]
+    print("rtm ({0:,} message events)".format(events))
+    print("{0:<40}{1:>12,.0f} events/s".format("websocket_watch", received[0] / elapsed))
+    server.stop()
+    print()
+
+
+@tornado.gen.coroutine
+def bench_events_api(events):
+    signing_secret = "benchmark-signing-secret"
+    server = FakeSlackServer(users=1000, channels=100)
+    server.start()
+    bot = SlackBot(server.client())
+    received = [ 0 ]
+
+    def on_mention(event):
+        received[0] += 1
+
+    bot.add_event_listener("app_mention", on_mention)
+    receiver = EventsAPIReceiver(bot, signing_secret)
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(1024)
+    sock.setblocking(False)
+    http_server = tornado.httpserver.HTTPServer(receiver.application(log_function=lambda handler: None))
+    http_server.add_sockets([ sock ])
+    url = "http://127.0.0.1:{0}/slack/events".format(sock.getsockname()[1])
+    http_client = tornado.httpclient.AsyncHTTPClient(force_instance=True, max_clients=50)
+    indexes = iter(range(events))
+
+    @tornado.gen.coroutine
+    def pusher():
+        for index in indexes:
+            event = { "type": "app_mention", "channel": "C00000001", "user": "U00000001",
+                "text": "<@U99999999> hello", "ts": server.next_ts() }
+            event_id = "Ev{0:08d}".format(index)
+            yield http_client.fetch(signed_event_request(url, signing_secret, event, event_id))
+            # as if the first delivery of 1 event out of 10 was not acknowledged in time
+            if index % 10 == 0:
+                yield http_client.fetch(signed_event_request(url, signing_secret, event, event_id,
+                    retry_num=1))
+
+    started = time.monotonic()
+    yield [ pusher() for _ in range(50) ]
+    while received[0] < events:
+        yield tornado.gen.moment
+    elapsed = time.monotonic() - started
+    print("events api ({0:,} events, {1:,} retries)".format(events, receiver.retries))
+    print("{0:<40}{1:>12,.0f} events/s  duplicates dropped: {2}".format("EventsAPIReceiver",
+        received[0] / elapsed, receiver.duplicates))
+    http_client.close()
+    http_server.stop()
+    server.stop()
+    print()
+
+
+# run by bench_startup in a new interpreter, with the host of the fake server as argument
+STARTUP_SCRIPT = """
+import sys, json, time
+started = time.perf_counter()
+import slacktor.slack
+imported = time.perf_counter()
+import tornado.ioloop
+
+async def post():
+    slack = slacktor.slack.Slack("xoxb-startup")
+    post_message = slack.api.chat.post_message.set_host(sys.argv[1]).set_rate_limiter(None)
+    post_message.protocol = "http"
+    call_started = time.perf_counter()
+    await post_message(channel="C00000001", text="first")
+    first_call = time.perf_counter() - call_started
+    call_started = time.perf_counter()
+    await post_message(channel="C00000001", text="second")
+    return first_call, time.perf_counter() - call_started
+
+first_call, second_call = tornado.ioloop.IOLoop.current().run_sync(post)
+print(json.dumps({ "import": imported - started, "first_call": first_call, "second_call": second_call }))
+"""
+
+
+@tornado.gen.coroutine
+def bench_startup(runs):
+    server = FakeSlackServer(users=10, channels=10)
+    server.start()
+    results = []
+    for _ in range(runs):
+        process = tornado.process.Subprocess([ sys.executable, "-c", STARTUP_SCRIPT, server.host ],
+                stdout=tornado.process.Subprocess.STREAM)
+        output = yield process.stdout.read_until_close()
+        yield process.wait_for_exit()
+        results.append(json.loads(output.decode("utf-8")))
+    print("startup (median of {0} new interpreters)".format(runs))
+    for key, name in (("import", "import slacktor.slack"), ("first_call", "first chat.postMessage"),
+            ("second_call", "second chat.postMessage")):
+        values = sorted(result[key] for result in results)
+        print("{0:<40}{1:>12.1f}ms".format(name, values[len(values) // 2] * 1000))
+    server.stop()
+    print()
+
+
+@tornado.gen.coroutine
+def main(quick=False):
+    scale = 10 if quick else 1
+    yield bench_web_api(calls=2000 // scale, latency=0.005)
+    yield bench_cache(users=100000 // scale, channels=5000 // scale)
+    yield bench_rtm(events=50000 // scale)
+    yield bench_events_api(events=10000 // scale)
+    yield bench_startup(runs=5 if quick else 15)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="run 10 times less calls and events")
+    args = parser.parse_args()
+    # the failed calls are expected, do not log them
+    logging.disable(logging.WARNING)
+    tornado.ioloop.IOLoop.current().run_sync(lambda: main(quick=args.quick))
@@ -1,53 +1,159 @@
 
 import re
-import json
-import types
 import functools
+import importlib
 
-import tornado.gen
-import tornado.httpclient
-from .api_wrapper import RestAPI
+from .api_wrapper import RestAPI, RateLimitScheduler, HTTPClientPool, JSONResponse, use_uvloop
 
 URL_PARAMS_REGEX = re.compile("(\{.*?\})")
 
+# Slack's rate limit tiers, as (calls per minute, burst)
+# see https://api.slack.com/docs/rate-limits
+# chat.postMessage has no tier: it is limited to about 1 message per second per channel, which
+# a bucket per token cannot express, see slackbot.sender.MessageSender for the pacing.
+RATE_TIERS = {
+    1: (1, 3),
+    2: (20, 5),
+    3: (50, 10),
+    4: (100, 20),
+}
+
+class _CompiledEndpoint(object):
+    """An endpoint definition compiled into a RestAPI, shared by all the tokens
+
+    The api is never called, each token gets a copy of it (see RestAPI.copy), which shares
+    the compiled params, url params and definition with it.
+    """
+
+    __slots__ = ("api", "bucket", "rate", "burst")
+
+    def __init__(self, definition):
+        # the definitions are shared by all the tokens, do not modify them
+        definition = dict(definition)
+        definition["host"] = "slack.com" if "host" not in definition else definition["host"]
+        definition["protocol"] = "https" if "protocol" not in definition else definition["protocol"]
+        parse_data = definition.pop("parse_data", None)
+        rate_tier = definition.get("rate_tier")
+        self.api = RestAPI.from_config(definition).set(decode="utf-8")
+        if parse_data is not None:
+            self.api.set(response_class=functools.partial(SlackResponse, parse_data=parse_data))
+        self.bucket = self.rate = self.burst = None
+        if rate_tier is not None:
+            calls_per_minute, burst = RATE_TIERS[rate_tier]
+            # buckets are named after the slack method, i.e. chat.postMessage
+            self.bucket = definition["url"].rsplit("/", 1)[-1]
+            self.rate = calls_per_minute / 60.0
+            self.burst = burst
+
+
+# id of the api definitions -> (api definitions, { function name -> _CompiledEndpoint })
+_COMPILED_DEFINITIONS = {}
+
+def _get_compiled_endpoint(api_definitions, function_name):
+    """Compile the definition of an endpoint, once per definitions"""
+    compiled = _COMPILED_DEFINITIONS.get(id(api_definitions))
+    if compiled is None or compiled[0] is not api_definitions:
+        compiled = _COMPILED_DEFINITIONS[id(api_definitions)] = (api_definitions, {})
+    endpoint = compiled[1].get(function_name)
+    if endpoint is None:
+        endpoint = compiled[1][function_name] = _CompiledEndpoint(api_definitions[function_name])
+    return endpoint
+
+
 class _GenericAPI(object):
+    """The endpoints of a slack api (i.e. users) for a token
+
+    The endpoints are created on first access, i.e. api.info, and stay on the object.
+    """
 
     def __init__(self, token, api_definitions, http_client=None):
         self.token = token
-        self.http_client = http_client or tornado.httpclient.AsyncHTTPClient()
-
-        for function_name, definition in api_definitions.items():
-            definition["host"] = "slack.com" if "host" not in definition else definition["host"]
-            definition["protocol"] = "https" if "protocol" not in definition else definition["protocol"]
-            parse_data = definition.pop("parse_data", None)
-            definition = (RestAPI.from_config(definition)
-                .set(decode="utf-8").partial(token=self.token))
-            if parse_data is not None:
-                definition.add_post_response_hook(hooks=functools.partial(
-                    self._post_response, parse_data=parse_data))
-            setattr(self, function_name, definition)
-
-    def _post_response(self, response, parse_data=None):
-        if parse_data is not None and not isinstance(parse_data, (list, set, tuple)):
-            parse_data = list(parse_data)
-
-        try:
-            response.json_body = json.loads(response.body.decode("utf-8"))
-            if parse_data is not None:
-                response.data = types.SimpleNamespace()
-                response.data.ok = response.json_body["ok"]
-                response.data.error = response.json_body.get("error")
-                if response.data.ok:
-                    for key in parse_data:
-                        setattr(response.data, key, response.json_body.get(key))
-
-        except Exception as e:
-            import traceback; traceback.print_exc()
-            response.json_body = None
-            response.ok = False
-
-        return False
-
-
-from . import slack
-from . import slackbot
+        self.http_client = http_client or HTTPClientPool()
+        self.rate_limiter = RateLimitScheduler.for_key(token)
+        self._api_definitions = api_definitions
+        # the middlewares of the endpoints created from now on
+        self._middlewares = []
+        # function name -> RestAPI, the endpoints created so far
+        self._endpoints = {}
+
+    def __getattr__(self, function_name):
+        # only called when the endpoint is not created yet
+        if function_name.startswith("_") or function_name not in self._api_definitions:
+            raise AttributeError(function_name)
+        return self._create_endpoint(function_name)
+
+    @property
+    def endpoints(self):
+        """function name -> RestAPI, of all the endpoints of this api"""
+        for function_name in self._api_definitions:
+            if function_name not in self._endpoints:
+                self._create_endpoint(function_name)
+        return self._endpoints
+
+    def add_middleware(self, middleware):
+        """Add a middleware to all the endpoints, see RestAPI.add_middleware"""
+        self._middlewares.append(middleware)
+        for endpoint in self._endpoints.values():
+            endpoint.add_middleware(middleware)
+        return self
+
+    def set_middlewares(self, middlewares):
+        """Replace the middlewares of all the endpoints, see RestAPI.add_middleware"""
+        self._middlewares = list(middlewares)
+        for endpoint in self._endpoints.values():
+            endpoint.set_middlewares(middlewares)
+        return self
+
+    def _create_endpoint(self, function_name):
+        compiled = _get_compiled_endpoint(self._api_definitions, function_name)
+        definition = (compiled.api.copy().partial(token=self.token)
+            .set_httpclient(self.http_client))
+        if compiled.bucket is not None:
+            definition.set_rate_limiter(self.rate_limiter.bucket(compiled.bucket, compiled.rate,
+                compiled.burst))
+        if self._middlewares:
+            definition.set_middlewares(self._middlewares)
+        setattr(self, function_name, definition)
+        self._endpoints[function_name] = definition
+        return definition
+
+
+class ResponseData(object):
+    """A read only view over some keys of the json body of a slack response
+
+    ok and error are always available, the other keys are the parse_data of the api.
+    Nothing is copied, the values are read from the json body when accessed.
+    """
+
+    __slots__ = ("_json_body", "_fields")
+
+    def __init__(self, json_body, fields):
+        self._json_body = json_body if isinstance(json_body, dict) else {}
+        self._fields = fields
+
+    def __getattr__(self, name):
+        if name in ("ok", "error") or name in self._fields:
+            return self._json_body.get(name)
+        raise AttributeError(name)
+
+
+class SlackResponse(JSONResponse):
+    """A slack api response, with the parse_data of the api available as response.data"""
+
+    def __init__(self, response, decode=None, parse_data=None):
+        super().__init__(response, decode=decode)
+        self._parse_data = frozenset(parse_data or ())
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = ResponseData(self.json_body, self._parse_data)
+        return self._data
+
+
+def __getattr__(name):
+    # slack and slackbot are imported on first use, see __getattr__ of modules (PEP 562)
+    if name in ("slack", "slackbot"):
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
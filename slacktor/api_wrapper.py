@@ -6,8 +6,9 @@ Github: https://github.com/ZwodahS
 Api wrappers is a tornado wrapper that allows developers to describe rest api
 in the form of a dictionary and call them like a method.
 
-This is written with support for python2's tornado, which means tornado.gen.Return
-instead of just return.
+The calls are native coroutines (async def) running on the asyncio event loop, which is
+uvloop if use_uvloop is called and uvloop is installed. A call returns an asyncio Task, so
+it can be awaited, or yielded from a tornado.gen.coroutine like before.
 
 As of now, this is not feature complete, please extend as you see fit.
 
@@ -20,15 +21,61 @@ You should set retries_status for POST/PUT/DELETE call to empty
 Some TODO
 1. allow params to the dot separated. (mainly for json body)
 """
+import os
 import re
 import six
+import asyncio
 import json
 import time
+import bisect
+import random
 import logging
+import datetime
+import functools
+import collections
+import urllib.parse
 
 import tornado.gen
+import tornado.util
+import tornado.locks
+import tornado.ioloop
+import tornado.concurrent
 import tornado.httpclient
 
+try:
+    import pycurl
+    import tornado.curl_httpclient
+except ImportError:
+    pycurl = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# use the fastest json parser available, all of them can parse bytes directly
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        json_loads = ujson.loads
+    except ImportError:
+        json_loads = json.loads
+
+def use_uvloop():
+    """Use uvloop for the asyncio event loops created from now on, if uvloop is installed
+
+    Call this before the IOLoop is created.
+
+    return              True if uvloop is used
+    """
+    if uvloop is None:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
 #################### Exceptions #####################
 class RestAPIParserException(Exception):
     pass
@@ -37,39 +84,1300 @@ class RestAPIParserException(Exception):
 class RestAPIRuntimeException(Exception):
     pass
 
+
+class RestAPIDeadlineExceeded(RestAPIRuntimeException):
+    """Raised when a call cannot complete before its deadline"""
+    pass
+
+#################### Retry policy #####################
+class RetryPolicy(object):
+    """Describe how a call is retried
+
+    base_delay          the delay before the first retry, doubled on every retry (in seconds) (default: 0.5)
+    max_delay           the max delay between two tries (in seconds) (default: 30)
+    deadline            the max time a call can take, including all the retries and the time spent
+                        waiting for the rate limiter (in seconds) (default: None, no deadline)
+    connect_timeout     the connect timeout of each try (in seconds) (default: None, tornado's default)
+    request_timeout     the request timeout of each try (in seconds) (default: None, tornado's default)
+
+    The delay between tries uses exponential backoff with full jitter, i.e. a random value
+    between 0 and min(max_delay, base_delay * 2 ** retry), so that coroutines that failed
+    together do not retry together.
+
+    RetryPolicy are immutable, use replace to create a modified copy.
+    """
+
+    def __init__(self, base_delay=0.5, max_delay=30.0, deadline=None,
+            connect_timeout=None, request_timeout=None):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+
+    def replace(self, **changes):
+        """Return a copy of this policy with some values changed"""
+        values = dict(base_delay=self.base_delay, max_delay=self.max_delay, deadline=self.deadline,
+                connect_timeout=self.connect_timeout, request_timeout=self.request_timeout)
+        values.update(changes)
+        return RetryPolicy(**values)
+
+    def backoff(self, retry):
+        """The time to wait before the {retry}-th retry (starting from 1)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (retry - 1))))
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+#################### Rate limiting #####################
+class TokenBucket(object):
+    """A FIFO token bucket used to pace the calls made to a single endpoint
+
+    rate                the number of tokens added to the bucket per second
+    burst               the max number of tokens the bucket can hold (default: 1)
+    name                the name of the bucket, only used for reporting
+
+    Calls that cannot proceed right away are queued in the order they arrive and
+    released one at a time as tokens become available.
+    """
+
+    def __init__(self, rate, burst=None, name=None):
+        self.name = name
+        self.rate = float(rate)
+        self.burst = burst if burst is not None else 1
+        self.tokens = float(self.burst)
+        self.paused_until = 0
+        self._last_refill = time.monotonic()
+        self._waiters = collections.deque()
+        self._draining = False
+
+        # stats
+        self.acquired = 0
+        self.rate_limited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def queue_depth(self):
+        """The number of calls waiting for a token"""
+        return len(self._waiters)
+
+    def acquire(self):
+        """Take a token from the bucket
+
+        return              a future that resolves to the time waited (in seconds)
+                            when the call is allowed to proceed.
+
+        Cancel the future to give up the place in the queue.
+        """
+        future = tornado.concurrent.Future()
+        self._refill()
+        if not self._waiters and self.tokens >= 1 and self.paused_until <= time.monotonic():
+            self.tokens -= 1
+            self._record_wait(0)
+            future.set_result(0)
+            return future
+
+        self._waiters.append((future, time.monotonic()))
+        if not self._draining:
+            self._draining = True
+            tornado.ioloop.IOLoop.current().spawn_callback(self._drain)
+        return future
+
+    def pause(self, seconds):
+        """Stop releasing tokens for {seconds} seconds
+
+        This is used when the server tells us that we are rate limited (HTTP 429).
+        """
+        self.rate_limited += 1
+        self.tokens = 0
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def stats(self):
+        """Return the current state of the bucket as a dict"""
+        return {
+            "queued": self.queue_depth,
+            "tokens": self.tokens,
+            "paused_for": max(0, self.paused_until - time.monotonic()),
+            "acquired": self.acquired,
+            "rate_limited": self.rate_limited,
+            "total_wait": self.total_wait,
+            "max_wait": self.max_wait,
+            "avg_wait": self.total_wait / self.acquired if self.acquired else 0.0,
+        }
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _record_wait(self, wait):
+        self.acquired += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    async def _drain(self):
+        try:
+            while self._waiters:
+                now = time.monotonic()
+                if self.paused_until > now:
+                    await tornado.gen.sleep(self.paused_until - now)
+                    continue
+                self._refill()
+                if self.tokens < 1:
+                    await tornado.gen.sleep((1 - self.tokens) / self.rate)
+                    continue
+                future, queued_at = self._waiters.popleft()
+                if future.done(): # cancelled while waiting
+                    continue
+                self.tokens -= 1
+                wait = time.monotonic() - queued_at
+                self._record_wait(wait)
+                future.set_result(wait)
+        finally:
+            self._draining = False
+
+
+class RateLimitScheduler(object):
+    """A group of TokenBucket, one per endpoint.
+
+    Use RateLimitScheduler.for_key to get a scheduler that is shared by every RestAPI
+    using the same key (for example the same api token).
+    """
+
+    _schedulers = {}
+
+    def __init__(self):
+        self.buckets = {}
+
+    @classmethod
+    def for_key(cls, key):
+        """Get the scheduler for this key, creating it if necessary"""
+        scheduler = cls._schedulers.get(key)
+        if scheduler is None:
+            scheduler = cls._schedulers[key] = cls()
+        return scheduler
+
+    @classmethod
+    def discard(cls, key):
+        """Forget the scheduler of this key, i.e. when the token is revoked
+
+        return              the scheduler, or None if there was none
+        """
+        return cls._schedulers.pop(key, None)
+
+    def bucket(self, name, rate, burst=None):
+        """Get the bucket for this name, creating it if necessary
+
+        name                the name of the bucket, usually the name of the endpoint
+        rate                the number of calls allowed per second
+        burst               the number of calls that can be made in a burst (default: 1)
+        """
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            bucket = self.buckets[name] = TokenBucket(rate, burst, name=name)
+        return bucket
+
+    def stats(self):
+        """Return the stats of all the buckets, keyed by the name of the bucket"""
+        return { name: bucket.stats() for name, bucket in six.iteritems(self.buckets) }
+
+#################### HTTP client pool #####################
+class HTTPClientPool(object):
+    """A single http client shared by many RestAPI, with concurrency limits
+
+    http_client         the AsyncHTTPClient to use (default: None, created on first use)
+    max_concurrency     the max number of requests in flight (default: 10)
+    max_per_host        the max number of requests in flight to the same host, either an int
+                        for all hosts or a dict of { host: limit } (default: None, no limit)
+    keepalive           keep the connections open between requests (default: True)
+                        Only tornado.curl_httpclient reuses connections, tornado's simple http
+                        client always opens a new connection.
+    use_curl            use tornado.curl_httpclient (default: None, use it if pycurl is installed)
+
+    This has the same fetch method as AsyncHTTPClient, so it can be used as the http_client
+    of a RestAPI. Requests over the limits wait in a queue.
+    """
+
+    def __init__(self, http_client=None, max_concurrency=10, max_per_host=None, keepalive=True,
+            use_curl=None):
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.keepalive = keepalive
+        self.use_curl = use_curl if use_curl is not None else pycurl is not None
+        if self.use_curl and pycurl is None:
+            raise RestAPIRuntimeException("pycurl is required to use curl_httpclient")
+        self._http_client = http_client
+        self._semaphore = tornado.locks.Semaphore(max_concurrency)
+        self._host_semaphores = {}
+
+        # stats
+        self.active = 0
+        self.queued = 0
+        self.completed = 0
+        self.reused = 0
+        self.active_per_host = collections.Counter()
+
+    @property
+    def http_client(self):
+        """The underlying AsyncHTTPClient"""
+        if self._http_client is None:
+            if self.use_curl:
+                self._http_client = tornado.curl_httpclient.CurlAsyncHTTPClient(
+                        force_instance=True, max_clients=self.max_concurrency)
+            else:
+                self._http_client = tornado.httpclient.AsyncHTTPClient(
+                        force_instance=True, max_clients=self.max_concurrency)
+        return self._http_client
+
+    async def fetch(self, request, raise_error=True, **kwargs):
+        """Fetch a request, waiting for a free slot first
+
+        Same as AsyncHTTPClient.fetch
+        """
+        if not isinstance(request, tornado.httpclient.HTTPRequest):
+            request = tornado.httpclient.HTTPRequest(url=request, **kwargs)
+        host = urllib.parse.urlsplit(request.url).netloc
+        semaphores = [ self._semaphore ]
+        host_semaphore = self._get_host_semaphore(host)
+        if host_semaphore is not None:
+            # take the host slot first so that a busy host does not hold the global slots
+            semaphores.insert(0, host_semaphore)
+
+        timeout = datetime.timedelta(seconds=min(request.request_timeout or 20.0,
+                request.connect_timeout or 20.0))
+        acquired = []
+        self.queued += 1
+        try:
+            for semaphore in semaphores:
+                await semaphore.acquire(timeout=timeout)
+                acquired.append(semaphore)
+        except BaseException as e:
+            # including the cancellation of the caller, or the slots are lost for good
+            for semaphore in acquired:
+                semaphore.release()
+            if isinstance(e, tornado.util.TimeoutError):
+                raise tornado.httpclient.HTTPError(599, "Timeout in request queue")
+            raise
+        finally:
+            self.queued -= 1
+
+        self.active += 1
+        self.active_per_host[host] += 1
+        try:
+            if not self.keepalive:
+                request.headers["Connection"] = "close"
+            response = await self.http_client.fetch(request, raise_error=raise_error)
+        finally:
+            self.active -= 1
+            self.active_per_host[host] -= 1
+            if not self.active_per_host[host]:
+                del self.active_per_host[host]
+            for semaphore in acquired:
+                semaphore.release()
+
+        self.completed += 1
+        # curl reports a connect time of 0 when the connection is reused
+        if self.use_curl and response.time_info.get("connect") == 0:
+            self.reused += 1
+        return response
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "queued": self.queued,
+            "completed": self.completed,
+            "reused": self.reused,
+            "active_per_host": dict(self.active_per_host),
+        }
+
+    def close(self):
+        if self._http_client is not None:
+            self._http_client.close()
+            self._http_client = None
+
+    def _get_host_semaphore(self, host):
+        if self.max_per_host is None:
+            return None
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            if isinstance(self.max_per_host, dict):
+                limit = self.max_per_host.get(host)
+                if limit is None:
+                    return None
+            else:
+                limit = self.max_per_host
+            semaphore = self._host_semaphores[host] = tornado.locks.Semaphore(limit)
+        return semaphore
+
 #################### Utility functions #####################
 
 
-@tornado.gen.coroutine
-def _fetch_with_retries(http_client, request, max_tries=None, retries_status=None,
-        retry_delay=5):
+def _get_retry_after(response, default):
+    """Read the Retry-After header (in seconds) of a response"""
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (AttributeError, TypeError, ValueError):
+        return default
+
+
+async def _fetch_with_retries(http_client, request, max_tries=None, retries_status=None,
+        retry_delay=None, rate_limiter=None, retry_policy=None, deadline=None, metrics=None):
     """Fetch a request with retries
 
     http_client         The httpclient to use
     request             The request to fetch
-    max_tries           The max number of tries to try (default: 3)
-    retries_status      The status to retry on. (default (599, 503, 504))
+    max_tries           The max number of tries to try (default: 5)
+    retries_status      The status to retry on. (default: empty)
                         (provide a list/tuple of int)
+    retry_delay         A fixed time to wait between tries (in seconds).
+                        If not specified, the backoff of the retry_policy is used.
+    rate_limiter        A TokenBucket to take a token from before each try (default: None)
+    retry_policy        The RetryPolicy to use (default: DEFAULT_RETRY_POLICY)
+    deadline            The max time this fetch can take (in seconds).
+                        If not specified, use the deadline of the retry_policy.
+    metrics             The EndpointMetrics to record the tries and the call to (default: None)
+
+    HTTP 429 is always retried. The Retry-After header is honoured, and if a rate_limiter
+    is provided, the bucket is paused so that other calls to the same endpoint wait as well.
+
+    raise RestAPIDeadlineExceeded as soon as the deadline cannot be met.
     """
     max_tries = max_tries if max_tries is not None else 5
     retries_status = retries_status if retries_status is not None else tuple()
+    retry_policy = retry_policy if retry_policy is not None else DEFAULT_RETRY_POLICY
+    deadline = deadline if deadline is not None else retry_policy.deadline
+    end_time = time.monotonic() + deadline if deadline is not None else None
+    request_timeout = request.request_timeout
+
+    def remaining():
+        return end_time - time.monotonic() if end_time is not None else None
+
+    def deadline_exceeded():
+        return RestAPIDeadlineExceeded("Deadline of {0}s exceeded: {1}".format(deadline, request.url))
 
     tries = 0
     response = None
-    while tries < max_tries:
-        tries += 1
-        response = yield http_client.fetch(request, raise_error=False)
-        if response is None or response.code in retries_status:
-            logging.debug("Fail to fetch: {url}, Code: {code}, retrying ... {current_try}/{max_try}".format(
-                url=request.url, code=response.code, current_try=tries, max_try=max_tries))
-            yield tornado.gen.Task(tornado.ioloop.IOLoop.instance().add_timeout,
-                time.time() + retry_delay)
-            continue
-        raise tornado.gen.Return(response)
-    raise tornado.gen.Return(response)
+    started_at = time.monotonic()
+    try:
+        while tries < max_tries:
+            tries += 1
+            queued_at = time.monotonic()
+            if rate_limiter is not None:
+                future = rate_limiter.acquire()
+                if end_time is not None:
+                    try:
+                        await tornado.gen.with_timeout(datetime.timedelta(seconds=max(0, remaining())), future)
+                    except tornado.util.TimeoutError:
+                        future.cancel()
+                        raise deadline_exceeded()
+                else:
+                    await future
+
+            if end_time is not None:
+                if remaining() <= 0:
+                    raise deadline_exceeded()
+                request.request_timeout = min(request_timeout or 20.0, remaining())
+
+            sent_at = time.monotonic()
+            try:
+                response = await http_client.fetch(request, raise_error=False)
+            except (tornado.httpclient.HTTPError, IOError) as e:
+                # newer tornado raise on timeout and connection errors even with raise_error=False
+                response = tornado.httpclient.HTTPResponse(request, 599, error=e, request_time=0)
+            if metrics is not None:
+                elapsed = time.monotonic() - sent_at
+                # request_time does not include the time waiting for a slot of a HTTPClientPool
+                network_time = min(response.request_time or elapsed, elapsed)
+                metrics.record_try(request, response, queue_time=sent_at - queued_at + elapsed - network_time,
+                        network_time=network_time)
+            code = response.code if response is not None else None
+            if code == 599 and end_time is not None and remaining() <= 0:
+                raise deadline_exceeded()
+
+            if code == 429:
+                delay = _get_retry_after(response, retry_delay if retry_delay is not None else
+                        retry_policy.backoff(tries))
+                # pause even if this call gives up, the other calls to the endpoint must wait
+                if rate_limiter is not None:
+                    rate_limiter.pause(delay)
+            elif response is None or code in retries_status:
+                delay = retry_delay if retry_delay is not None else retry_policy.backoff(tries)
+            else:
+                break
+
+            logging.debug("Fail to fetch: {url}, Code: {code}, retrying in {delay:.2f}s ... {current_try}/{max_try}".format(
+                url=request.url, code=code, delay=delay, current_try=tries, max_try=max_tries))
+            if tries >= max_tries:
+                break
+            if end_time is not None and delay >= remaining():
+                raise deadline_exceeded()
+            if code != 429 or rate_limiter is None:
+                # on 429 the next try waits for the paused rate_limiter instead
+                await tornado.gen.sleep(delay)
+    except Exception:
+        if metrics is not None:
+            metrics.record_call(tries, time.monotonic() - started_at, failed=True)
+        raise
+    if metrics is not None:
+        metrics.record_call(tries, time.monotonic() - started_at, failed=False)
+    return response
 
 fetch_with_retries = _fetch_with_retries
 
+
+def _get_json_body(response):
+    """Get the parsed json body of a response, parsing it if no hook did"""
+    json_body = getattr(response, "json_body", None)
+    if json_body is None and response.body is not None:
+        json_body = json_loads(response.body)
+    return json_body
+
+#################### Responses #####################
+_NOT_PARSED = object()
+
+
+class JSONResponse(object):
+    """A response that is decoded and parsed lazily
+
+    response            the tornado HTTPResponse
+    decode              the encoding used for decoded_body (default: None, no decoded_body)
+
+    json_body is parsed directly from the bytes of the body the first time it is read,
+    using orjson or ujson if installed. It is None if the body is not valid json.
+    All the other attributes are read from the HTTPResponse.
+    """
+
+    def __init__(self, response, decode=None):
+        self.response = response
+        self.code = response.code
+        self.body = response.body
+        self._decode = decode
+        self._json_body = _NOT_PARSED
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    @property
+    def decoded_body(self):
+        if self._decode is None or self.body is None:
+            raise AttributeError("decoded_body")
+        return self.body.decode(self._decode)
+
+    @property
+    def json_body(self):
+        if self._json_body is _NOT_PARSED:
+            try:
+                self._json_body = json_loads(self.body) if self.body else None
+            except ValueError:
+                logging.debug("Fail to parse json body: {0}".format(self.body[:200]))
+                self._json_body = None
+        return self._json_body
+
+    @json_body.setter
+    def json_body(self, value):
+        self._json_body = value
+
+    @property
+    def is_parsed(self):
+        """True if the json body has been parsed"""
+        return self._json_body is not _NOT_PARSED
+
+#################### Response cache #####################
+class CachedResponse(object):
+    """The part of a response that is kept in a ResponseCache
+
+    Only the status and headers of the response, and the values parsed by the post response
+    hooks (json_body, data) are kept. The body (and decoded_body) is only kept if nothing
+    was parsed from it.
+    """
+
+    PARSED_ATTRIBUTES = ("json_body", "data")
+
+    def __init__(self, response):
+        self.code = response.code
+        self.reason = response.reason
+        self.headers = response.headers
+        self.error = None
+        self.size = len(response.body) if response.body is not None else 0
+        parsed = False
+        for key in CachedResponse.PARSED_ATTRIBUTES:
+            if getattr(response, key, None) is not None:
+                setattr(self, key, getattr(response, key))
+                parsed = True
+        self.body = None if parsed else response.body
+        if not parsed and hasattr(response, "decoded_body"):
+            self.decoded_body = response.decoded_body
+
+
+class ResponseCache(object):
+    """A bounded LRU cache for responses, with ttl
+
+    max_entries         the max number of responses to keep (default: 1024)
+    max_bytes           the max total size of the responses to keep, measured on the size of
+                        the body (default: 64MB)
+    purge_interval      the interval between removals of expired entries (in seconds) (default: 60)
+
+    Concurrent fetches of the same key are merged into a single request.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, purge_interval=60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.purge_interval = purge_interval
+        self.bytes = 0
+        self._entries = collections.OrderedDict() # key -> (expiry, CachedResponse)
+        self._inflight = {}
+        self._purger = None
+
+        # stats
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key_for(request):
+        """The cache key of a request
+
+        RestAPI sorts the params of the requests it creates, so the same params give the same key.
+        """
+        return (request.method, request.url, request.body, request.auth_username)
+
+    def get(self, key):
+        """Get a cached response, or None if it is not cached or has expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, response, ttl):
+        """Cache a response for {ttl} seconds
+
+        return                  the CachedResponse that is stored
+        """
+        cached = response if isinstance(response, CachedResponse) else CachedResponse(response)
+        if key in self._entries:
+            self._remove(key)
+        if cached.size > self.max_bytes:
+            return cached
+        self._entries[key] = (time.monotonic() + ttl, cached)
+        self.bytes += cached.size
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        self._start_purger()
+        return cached
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def purge_expired(self):
+        """Remove all the expired entries"""
+        now = time.monotonic()
+        for key in [ key for key, entry in six.iteritems(self._entries) if entry[0] < now ]:
+            self._remove(key)
+            self.expirations += 1
+        if not self._entries and self._purger is not None:
+            self._purger.stop()
+            self._purger = None
+
+    async def fetch(self, key, ttl, fetch):
+        """Get a response from the cache, or fetch it
+
+        key                     the cache key, see key_for
+        ttl                     the time to cache the response (in seconds)
+        fetch                   a function that returns a future of the response
+
+        Only responses with status 200 are cached.
+        If the same key is already being fetched, wait for that fetch instead.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.shared += 1
+        else:
+            self.misses += 1
+            # the fetch runs in its own task, so cancelling any caller (including the first one)
+            # does not cancel it for the other callers
+            task = self._inflight[key] = asyncio.ensure_future(self._fetch(key, ttl, fetch))
+            task.add_done_callback(_retrieve_exception)
+        response = await asyncio.shield(task)
+        return response
+
+    async def _fetch(self, key, ttl, fetch):
+        try:
+            response = await fetch()
+            if response.code == 200:
+                response = self.put(key, response, ttl)
+            return response
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _remove(self, key):
+        _, cached = self._entries.pop(key)
+        self.bytes -= cached.size
+
+    def _start_purger(self):
+        if self._purger is None:
+            self._purger = tornado.ioloop.PeriodicCallback(self.purge_expired, self.purge_interval * 1000)
+            self._purger.start()
+
+
+DEFAULT_RESPONSE_CACHE = ResponseCache()
+
+
+def _retrieve_exception(future):
+    # the error is raised to the callers, do not log it as unretrieved if they are all gone
+    if not future.cancelled():
+        future.exception()
+
+#################### Metrics #####################
+class Histogram(object):
+    """A histogram with fixed buckets
+
+    buckets             the upper bounds of the buckets, in increasing order
+    """
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [ 0 ] * (len(buckets) + 1) # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        """[ (upper bound, number of values <= upper bound) ], ending with +Inf"""
+        total = 0
+        result = []
+        for bound, count in zip(list(self.buckets) + [ float("inf") ], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": self.cumulative_counts(),
+        }
+
+
+class EndpointMetrics(object):
+    """The metrics of a single endpoint, see APIMetrics
+
+    calls               the number of calls
+    errors              the number of calls that raised an exception
+    retries             the number of tries after the first one
+    status              { status code: number of tries }, 599 for connection errors
+    request_bytes       the size of the request bodies sent
+    response_bytes      the size of the response bodies received
+    queue_time          the time a try waited for the rate limiter and the http client pool
+    network_time        the time a try spent in the http client
+    call_time           the time of a call, including retries and backoff
+    """
+
+    __slots__ = ("calls", "errors", "retries", "status", "request_bytes", "response_bytes",
+            "queue_time", "network_time", "call_time")
+
+    def __init__(self, buckets):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.status = collections.Counter()
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.queue_time = Histogram(buckets)
+        self.network_time = Histogram(buckets)
+        self.call_time = Histogram(buckets)
+
+    def record_try(self, request, response, queue_time, network_time):
+        self.status[response.code] += 1
+        self.request_bytes += len(request.body) if request.body else 0
+        # a response without a buffer (i.e. a connection error) has no body
+        self.response_bytes += len(response.body) if response.buffer is not None else 0
+        self.queue_time.observe(queue_time)
+        self.network_time.observe(network_time)
+
+    def record_call(self, tries, call_time, failed):
+        self.calls += 1
+        self.retries += max(0, tries - 1)
+        self.errors += 1 if failed else 0
+        self.call_time.observe(call_time)
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "status": dict(self.status),
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+            "queue_time": self.queue_time.as_dict(),
+            "network_time": self.network_time.as_dict(),
+            "call_time": self.call_time.as_dict(),
+        }
+
+
+class APIMetrics(object):
+    """Metrics of the calls made by RestAPI, per endpoint
+
+    buckets             the upper bounds of the time histograms (in seconds)
+                        (default: DEFAULT_BUCKETS)
+
+    The metrics are only counters updated in place, so they are cheap enough to always be on.
+    Read them with snapshot or render_prometheus, or push them somewhere with add_exporter.
+    """
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets) if buckets is not None else self.DEFAULT_BUCKETS
+        self.endpoints = {}
+        self._exporters = []
+
+    def endpoint(self, name):
+        """The EndpointMetrics of an endpoint, created on first use"""
+        metrics = self.endpoints.get(name)
+        if metrics is None:
+            metrics = self.endpoints[name] = EndpointMetrics(self.buckets)
+        return metrics
+
+    def snapshot(self):
+        """{ endpoint: EndpointMetrics.as_dict() }"""
+        return { name: metrics.as_dict() for name, metrics in self.endpoints.items() }
+
+    def reset(self):
+        self.endpoints = {}
+
+    def render_prometheus(self, prefix="slacktor_api"):
+        """Render the metrics in the prometheus text format"""
+        lines = []
+
+        def family(name, metric_type, help_text, samples):
+            lines.append("# HELP {0}_{1} {2}".format(prefix, name, help_text))
+            lines.append("# TYPE {0}_{1} {2}".format(prefix, name, metric_type))
+            for suffix, labels, value in samples:
+                lines.append("{0}_{1}{2}{{{3}}} {4}".format(prefix, name, suffix, ",".join(
+                    '{0}="{1}"'.format(key, _escape_label(label)) for key, label in labels), _format_value(value)))
+
+        endpoints = sorted(self.endpoints.items())
+        for name, field, help_text in (
+                ("calls_total", "calls", "The number of calls"),
+                ("errors_total", "errors", "The number of calls that raised an exception"),
+                ("retries_total", "retries", "The number of tries after the first one"),
+                ("request_bytes_total", "request_bytes", "The size of the request bodies sent"),
+                ("response_bytes_total", "response_bytes", "The size of the response bodies received")):
+            family(name, "counter", help_text, [ ("", [ ("endpoint", endpoint) ], getattr(metrics, field))
+                for endpoint, metrics in endpoints ])
+        family("responses_total", "counter", "The number of tries per status code", [
+            ("", [ ("endpoint", endpoint), ("code", code) ], count)
+            for endpoint, metrics in endpoints for code, count in sorted(metrics.status.items()) ])
+        for name, field, help_text in (
+                ("queue_seconds", "queue_time", "The time a try waited for the rate limiter and the pool"),
+                ("network_seconds", "network_time", "The time a try spent in the http client"),
+                ("call_seconds", "call_time", "The time of a call, including retries")):
+            samples = []
+            for endpoint, metrics in endpoints:
+                histogram = getattr(metrics, field)
+                for bound, count in histogram.cumulative_counts():
+                    # le="+Inf", not "inf", for the last bucket
+                    samples.append(("_bucket", [ ("endpoint", endpoint), ("le", _format_value(bound)) ], count))
+                samples.append(("_sum", [ ("endpoint", endpoint) ], histogram.sum))
+                samples.append(("_count", [ ("endpoint", endpoint) ], histogram.count))
+            family(name, "histogram", help_text, samples)
+        return "\n".join(lines) + "\n"
+
+    def add_exporter(self, exporter, interval=60):
+        """Call exporter(self) every {interval} seconds
+
+        exporter            a function, i.e. a PrometheusFileExporter
+
+        return              the PeriodicCallback, stop it to remove the exporter
+        """
+        callback = tornado.ioloop.PeriodicCallback(functools.partial(self._export, exporter), interval * 1000)
+        callback.start()
+        self._exporters.append(callback)
+        return callback
+
+    def stop_exporters(self):
+        for callback in self._exporters:
+            callback.stop()
+        self._exporters = []
+
+    def _export(self, exporter):
+        try:
+            exporter(self)
+        except Exception:
+            logging.exception("Fail to export metrics with {0}".format(exporter))
+
+
+class PrometheusFileExporter(object):
+    """Write the metrics to a file in the prometheus text format, i.e. for the textfile
+    collector of node_exporter
+
+    path                the file to write, it is replaced atomically
+    prefix              the prefix of the metric names (default: slacktor_api)
+    """
+
+    def __init__(self, path, prefix="slacktor_api"):
+        self.path = path
+        self.prefix = prefix
+
+    def __call__(self, metrics):
+        tmp_path = "{0}.tmp".format(self.path)
+        with open(tmp_path, "w") as f:
+            f.write(metrics.render_prometheus(prefix=self.prefix))
+        os.replace(tmp_path, self.path)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+DEFAULT_METRICS = APIMetrics()
+
+#################### Pagination #####################
+class CursorPaginator(object):
+    """Paginate by following a cursor found in the json body of the response
+
+    items               the key of the list of items in the json body
+    cursor_param        the param used to send the cursor (default: "cursor")
+    cursor_path         the path to the next cursor in the json body
+                        (default: ("response_metadata", "next_cursor"))
+    limit_param         the param used to set the page size (default: "limit")
+    page_size           the page size used if the limit_param is not provided (default: None)
+    """
+
+    def __init__(self, items, cursor_param="cursor", cursor_path=("response_metadata", "next_cursor"),
+            limit_param="limit", page_size=None):
+        self.items_key = items
+        self.cursor_param = cursor_param
+        self.cursor_path = tuple(cursor_path)
+        self.limit_param = limit_param
+        self.page_size = page_size
+
+    def first_params(self, params):
+        """Return the params of the first page"""
+        if self.page_size is not None and self.limit_param not in params:
+            params[self.limit_param] = self.page_size
+        return params
+
+    def next_params(self, response):
+        """Return the params to update to get the next page, or None if this is the last page"""
+        value = _get_json_body(response)
+        for key in self.cursor_path:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return { self.cursor_param: value } if value else None
+
+    def items(self, response):
+        """Return the items of a page"""
+        json_body = _get_json_body(response)
+        items = json_body.get(self.items_key) if isinstance(json_body, dict) else None
+        if items is None:
+            raise RestAPIRuntimeException("{0} not found in response".format(self.items_key))
+        return items
+
+
+class LatestPaginator(CursorPaginator):
+    """Paginate backward in time for history like endpoints
+
+    items               the key of the list of items in the json body, newest first
+    latest_param        the param used to send the end of the time range (default: "latest")
+    ts_key              the key of the timestamp of each item (default: "ts")
+    has_more_key        the key in the json body telling if there is more items (default: "has_more")
+    limit_param         the param used to set the page size (default: "count")
+    page_size           the page size used if the limit_param is not provided (default: None)
+    """
+
+    def __init__(self, items, latest_param="latest", ts_key="ts", has_more_key="has_more",
+            limit_param="count", page_size=None):
+        super().__init__(items, limit_param=limit_param, page_size=page_size)
+        self.latest_param = latest_param
+        self.ts_key = ts_key
+        self.has_more_key = has_more_key
+
+    def next_params(self, response):
+        json_body = _get_json_body(response)
+        if not isinstance(json_body, dict) or not json_body.get(self.has_more_key):
+            return None
+        items = json_body.get(self.items_key)
+        if not items:
+            return None
+        return { self.latest_param: items[-1][self.ts_key] }
+
+
+PAGINATORS = {
+    "cursor": CursorPaginator,
+    "latest": LatestPaginator,
+}
+
+
+class PageIterator(object):
+    """Iterate over the pages of a paginated RestAPI
+
+    Use RestAPI.pages to create this.
+
+    This is an async iterator,
+
+        async for response in api.pages(limit=200):
+            ...
+
+    or in a tornado coroutine,
+
+        pages = api.pages(limit=200)
+        response = yield pages.fetch_next()
+        while response is not None:
+            ...
+            response = yield pages.fetch_next()
+
+    The iteration stops after the first response that is not a 200, and that response is
+    returned so that the caller can deal with the error.
+    Only one page is held at a time, so memory is bounded by the page size.
+    """
+
+    def __init__(self, api, params):
+        self.api = api
+        self.params = api.paginator.first_params(params)
+        self.done = False
+        self.pages_fetched = 0
+
+    async def fetch_next(self):
+        """Fetch the next page
+
+        return              the response, or None if there is no more page
+        """
+        if self.done:
+            return None
+        response = await self.api(**self.params)
+        self.pages_fetched += 1
+        next_params = self.api.paginator.next_params(response) if response.code == 200 else None
+        if next_params:
+            self.params.update(next_params)
+        else:
+            self.done = True
+        return response
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        response = await self.fetch_next()
+        if response is None:
+            raise StopAsyncIteration
+        return response
+
+
+class ItemIterator(object):
+    """Iterate over the items of all the pages of a paginated RestAPI
+
+    Use RestAPI.iterate to create this.
+
+        async for member in api.iterate(limit=200):
+            ...
+
+    raise RestAPIRuntimeException if a page cannot be fetched.
+    """
+
+    def __init__(self, api, params):
+        self.pages = PageIterator(api, params)
+        self._items = collections.deque()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._items:
+            response = await self.pages.fetch_next()
+            if response is None:
+                raise StopAsyncIteration
+            if response.code != 200:
+                raise RestAPIRuntimeException("Fail to fetch page {0} of {1}, Code: {2}".format(
+                    self.pages.pages_fetched, self.pages.api.url, response.code))
+            self._items.extend(self.pages.api.paginator.items(response))
+        return self._items.popleft()
+
+class BulkResult(object):
+    """The result of one call of RestAPI.map
+
+    index               the position of the params in the list given to map
+    params              the params of the call
+    response            the response, None if the call raised an exception
+    error               the exception raised by the call, None if there is a response
+    """
+
+    __slots__ = ("index", "params", "response", "error")
+
+    def __init__(self, index, params, response=None, error=None):
+        self.index = index
+        self.params = params
+        self.response = response
+        self.error = error
+
+    @property
+    def ok(self):
+        """True if the call returned a 200"""
+        return self.error is None and self.response.code == 200
+
+    def result(self):
+        """Return the response, or raise the error of the call"""
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+    def __repr__(self):
+        return "BulkResult({0}, {1})".format(self.index,
+                repr(self.error) if self.error is not None else self.response.code)
+
+
+class BulkIterator(object):
+    """Call a RestAPI once per params, with a limited number of calls in flight
+
+    Use RestAPI.map to create this.
+
+    This is an async iterator of BulkResult,
+
+        async for result in api.map(params_list, concurrency=10):
+            ...
+
+    or in a tornado coroutine,
+
+        results = api.map(params_list, concurrency=10)
+        result = yield results.fetch_next()
+        while result is not None:
+            ...
+            result = yield results.fetch_next()
+
+    The results are returned as they complete, or in the order of params_list if ordered.
+    params_list can be a generator, it is only consumed as the calls are started.
+    The calls keep going while the results wait to be read, up to 2 * concurrency results
+    ahead of the reader, so that memory stays bounded.
+    """
+
+    def __init__(self, api, params_list, concurrency=10, ordered=False, options=None):
+        if concurrency < 1:
+            raise RestAPIRuntimeException("concurrency must be at least 1")
+        self.api = api
+        self.concurrency = concurrency
+        self.ordered = ordered
+        self.options = options or {}
+        self._params = iter(params_list)
+        self._exhausted = False
+        self._inflight = 0
+        self._started = 0
+        self._returned = 0
+        # index -> BulkResult if ordered, else a deque of BulkResult
+        self._results = {} if ordered else collections.deque()
+        self._condition = tornado.locks.Condition()
+
+        # stats
+        self.failed = 0
+
+    @property
+    def inflight(self):
+        """The number of calls in flight"""
+        return self._inflight
+
+    async def fetch_next(self):
+        """Wait for the next result
+
+        return              the BulkResult, or None if all the results were returned
+        """
+        self._start_calls()
+        while True:
+            result = self._pop_result()
+            if result is not None:
+                self._returned += 1
+                self._start_calls()
+                return result
+            if self._exhausted and self._inflight == 0:
+                return None
+            await self._condition.wait()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        result = await self.fetch_next()
+        if result is None:
+            raise StopAsyncIteration
+        return result
+
+    def _pop_result(self):
+        if self.ordered:
+            return self._results.pop(self._returned, None)
+        return self._results.popleft() if self._results else None
+
+    def _start_calls(self):
+        while (not self._exhausted and self._inflight < self.concurrency and
+                self._started - self._returned < 2 * self.concurrency):
+            try:
+                params = next(self._params)
+            except StopIteration:
+                self._exhausted = True
+                break
+            self._inflight += 1
+            tornado.ioloop.IOLoop.current().spawn_callback(self._call, self._started, params)
+            self._started += 1
+
+    async def _call(self, index, params):
+        try:
+            call_params = dict(self.options)
+            call_params.update(params)
+            response = await self.api(**call_params)
+            result = BulkResult(index, params, response=response)
+        except Exception as e:
+            self.failed += 1
+            result = BulkResult(index, params, error=e)
+        self._inflight -= 1
+        if self.ordered:
+            self._results[index] = result
+        else:
+            self._results.append(result)
+        self._start_calls()
+        self._condition.notify_all()
+
+#################### Param validation #####################
+def _to_string(value):
+    try:
+        return str(value)
+    except ValueError:
+        raise RestAPIRuntimeException("{0} cannot be converted to a string".format(value))
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise RestAPIRuntimeException("{0} cannot be converted to a int".format(value))
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        raise RestAPIRuntimeException("{0} cannot be converted to a float".format(value))
+
+
+def _check_dict(value):
+    if not isinstance(value, dict):
+        raise RestAPIRuntimeException("{0} is not a dictionary".format(value))
+    return value
+
+
+def _check_list(value):
+    if not isinstance(value, list):
+        raise RestAPIRuntimeException("{0} is not a list".format(value))
+    return value
+
+
+def _check_bool(value):
+    if not isinstance(value, bool):
+        raise RestAPIRuntimeException("{0} is not a boolean".format(value))
+    return value
+
+
+def _to_comma_string(value):
+    if isinstance(value, list):
+        try:
+            return ",".join(value)
+        except (TypeError, ValueError):
+            raise RestAPIRuntimeException("{0} cannot be converted to a comma separated string".format(value))
+    return value
+
+
+_BOOL_STRINGS = { True: "true", False: "false", "true": "true", "false": "false" }
+
+
+def _to_bool_string(value):
+    if isinstance(value, str):
+        value = value.lower()
+    elif not isinstance(value, bool):
+        raise RestAPIRuntimeException("{0} is not valid bool_string value".format(value))
+    if value not in _BOOL_STRINGS:
+        raise RestAPIRuntimeException("{0} is not valid bool_string value".format(value))
+    return _BOOL_STRINGS[value]
+
+
+_PARAM_CONVERTERS = {
+    "string": _to_string,
+    "int": _to_int,
+    "float": _to_float,
+    "dict": _check_dict,
+    "list": _check_list,
+    "bool": _check_bool,
+    "comma_string": _to_comma_string,
+    "bool_string": _to_bool_string,
+}
+
+
+def _compile_param(key, param):
+    """Compile the definition of a param into a function that checks and converts its value
+
+    return                  the function, or None if the value is used as it is
+    """
+    param_type = param.get("type")
+    if param_type in RestAPI.PARAM_TYPES:
+        convert = _PARAM_CONVERTERS[param_type]
+    elif callable(param_type):
+        convert = param_type
+    else:
+        convert = None
+
+    choices = param.get("choices")
+    if choices is None:
+        return convert
+    try:
+        choices = frozenset(choices)
+    except TypeError: # unhashable choices
+        pass
+
+    def convert_and_check_choices(value):
+        if convert is not None:
+            value = convert(value)
+        if value not in choices:
+            raise RestAPIRuntimeException("{0} not is not a valid value for {1}".format(value, key))
+        return value
+    return convert_and_check_choices
+
 #################### Main object #################
 class RestAPI(object):
     """
@@ -89,6 +1397,11 @@ class RestAPI(object):
 
     response = yield get_user_by_id(id="randomid")
 
+    Paginated apis are configured with "pagination", which is the type of the paginator
+    (see PAGINATORS) and the arguments to create it, i.e.
+
+        "pagination": { "type": "cursor", "items": "members", "page_size": 200 }
+
     do not use the constructor of RestAPI directly
     """
 
@@ -123,18 +1436,30 @@ class RestAPI(object):
     )
 
     def __init__(self):
-        self.http_client = tornado.httpclient.AsyncHTTPClient()
+        self.http_client = None # default to tornado's AsyncHTTPClient, see set_httpclient
         self.host = None
         self.auth_username = None
         self.auth_password = None
         self.post_response_hooks = []
+        self.middlewares = []
+        self._middleware_chain = None # composed from middlewares, see _compose_middlewares
         self.headers = {}
-        self.retries_status = {502, 503, 504, 599}
+        self.retries_status = {429, 502, 503, 504, 599}
         self.max_tries = 3
+        self.retry_policy = DEFAULT_RETRY_POLICY
+        self.rate_limiter = None
+        self.paginator = None
         self._default_values = {}
         self._partial_values = {}
-        self.cache = {}
+        # compiled from params, see _compile
+        self._converters = {}
+        self._required_params = frozenset()
+        self._allowed_params = frozenset()
+        self._base_values = {}
+        self.cache = DEFAULT_RESPONSE_CACHE
+        self.metrics = DEFAULT_METRICS
         self.decode = None
+        self.response_class = JSONResponse
 
     @classmethod
     def from_config(cls, config):
@@ -154,21 +1479,31 @@ class RestAPI(object):
         if "headers" in config:
             api.headers.update(config["headers"])
         api.params = config.get("params") if "params" in config else {}
+        if config.get("pagination") is not None:
+            pagination = dict(config["pagination"])
+            api.paginator = PAGINATORS[pagination.pop("type")](**pagination)
         # set up basic structure
         for key, param in six.iteritems(api.params):
             if "default" in param:
                 api._default_values[key] = param["default"]
+        api._compile()
         return api
 
     def set(self, **params):
         """Set the other stuffs in one shot
 
         The stuffs that can be set here are
-        decode, retries_status, max_tries
+        decode, retries_status, max_tries, retry_policy, cache, metrics, response_class
 
         decode                  what encoding to decode the response to. (default None)
-        retries_status          what status to retry the request on. (default 502, 503, 504, 599)
+        retries_status          what status to retry the request on. (default 429, 502, 503, 504, 599)
         max_tries               the number of tries when trying to perform the request. (default 3)
+        retry_policy            the RetryPolicy (backoff, deadline and timeouts) to use.
+                                (default DEFAULT_RETRY_POLICY)
+        cache                   the ResponseCache used when calling with _cache. (default DEFAULT_RESPONSE_CACHE)
+        metrics                 the APIMetrics to record the calls to, None to disable. (default DEFAULT_METRICS)
+        response_class          the class wrapping the HTTPResponse, called with (response, decode=decode).
+                                (default JSONResponse)
         """
         if "decode" in params:
             self.decode = params["decode"]
@@ -176,6 +1511,14 @@ class RestAPI(object):
             self.retries_status = params["retries_status"]
         if "max_tries" in params:
             self.max_tries = params["max_tries"]
+        if "retry_policy" in params:
+            self.retry_policy = params["retry_policy"]
+        if "cache" in params:
+            self.cache = params["cache"]
+        if "metrics" in params:
+            self.metrics = params["metrics"]
+        if "response_class" in params:
+            self.response_class = params["response_class"]
         return self
 
     def copy(self):
@@ -189,9 +1532,15 @@ class RestAPI(object):
         api.url_params = self.url_params
         api.params = self.params
 
+        # compiled values, these are never modified
+        api._converters = self._converters
+        api._required_params = self._required_params
+        api._allowed_params = self._allowed_params
+
         # mutable values
         api._default_values.update(self._default_values)
         api._partial_values.update(self._partial_values)
+        api._base_values = self._base_values
 
         api.http_client = self.http_client
         api.host = self.host
@@ -199,6 +1548,17 @@ class RestAPI(object):
         api.auth_password = self.auth_password
         api.headers.update(self.headers)
         api.post_response_hooks = [ h for h in self.post_response_hooks ]
+        api.middlewares = list(self.middlewares)
+        api._compose_middlewares()
+        api.retries_status = self.retries_status
+        api.max_tries = self.max_tries
+        api.retry_policy = self.retry_policy
+        api.cache = self.cache
+        api.metrics = self.metrics
+        api.decode = self.decode
+        api.response_class = self.response_class
+        api.rate_limiter = self.rate_limiter
+        api.paginator = self.paginator
         return api
 
     def auth(self, auth_username, auth_password, create_new=False):
@@ -239,7 +1599,7 @@ class RestAPI(object):
     def set_httpclient(self, http_client, create_new=False):
         """Set a default AsyncHTTPClient to use
 
-        http_client             a tornado.httpclient.AsyncHTTPClient instance
+        http_client             a tornado.httpclient.AsyncHTTPClient or a HTTPClientPool instance
         create_new              if True a new RestAPI object is returned,
                                 else the current one is modified (default: False)
 
@@ -249,6 +1609,19 @@ class RestAPI(object):
         copy.http_client = http_client
         return copy
 
+    def set_rate_limiter(self, rate_limiter, create_new=False):
+        """Set the TokenBucket that paces the calls to this api
+
+        rate_limiter            a TokenBucket instance, or None to disable rate limiting
+        create_new              if True a new RestAPI object is returned,
+                                else the current one is modified (default: False)
+
+        return                  instance of RestAPI
+        """
+        copy = self.copy() if create_new else self
+        copy.rate_limiter = rate_limiter
+        return copy
+
     def add_post_response_hook(self, hooks, create_new=False):
         """Add a post response hook
 
@@ -261,6 +1634,34 @@ class RestAPI(object):
         copy.post_response_hooks.append(hooks)
         return copy
 
+    def add_middleware(self, middleware, create_new=False):
+        """Add a middleware around the fetch of this api
+
+        middleware              a function (request, options, fetch) -> future of a HTTPResponse.
+                                options is a dict of the call options (retries_status, max_tries,
+                                retry_policy, deadline), fetch(request, options) calls the next
+                                middleware, or sends the request if this is the last one.
+                                A middleware can modify the request or the options, time the call,
+                                or return a response without calling fetch (i.e. from a cache).
+        create_new              if True a new RestAPI object is returned,
+                                else the current one is modified (default: False)
+
+        The middlewares are called in the order they are added, the first one is the outermost.
+        They are called once per call, the retries happen inside fetch. The response returned
+        is wrapped by the response_class and goes through the post response hooks as usual.
+        """
+        copy = self.copy() if create_new else self
+        copy.middlewares.append(middleware)
+        copy._compose_middlewares()
+        return copy
+
+    def set_middlewares(self, middlewares, create_new=False):
+        """Replace all the middlewares of this api, see add_middleware"""
+        copy = self.copy() if create_new else self
+        copy.middlewares = list(middlewares)
+        copy._compose_middlewares()
+        return copy
+
     def partial(self, create_new=False, **params):
         """Partially fill this api.
 
@@ -275,187 +1676,245 @@ class RestAPI(object):
             if key not in copy.params and key not in copy.url_params:
                 raise RestAPIRuntimeException("Invalid params {0}".format(key))
             copy._partial_values[key] = param
+        copy._merge_values()
         return copy
 
-    def __call__(self, _retries_status=None, _max_tries=None, _cache=None, **params):
+    def __call__(self, _retries_status=None, _max_tries=None, _cache=None, _retry_policy=None,
+            _deadline=None, **params):
         """The actual call method
 
         _retries_status        The status to retry on. If not specified, use object default (self.retries_status)
         _max_tries             The number of time to retry. If not specified, use object default (self.max_tries)
-        _cache                 Cache must be a tuple, (name_of_cache, time to cache (in minutes))
-
-        Note: This will return a future, that needs to be yield.
-        Returning a future here allows you to control when you yield it.
+        _cache                 The time to cache the response (in minutes). The cache key is derived
+                               from the request. (name_of_cache, time to cache) is also accepted,
+                               the name is ignored.
+        _retry_policy          The RetryPolicy to use. If not specified, use object default (self.retry_policy)
+        _deadline              The max time this call can take (in seconds).
+                               If not specified, use the deadline of the retry policy.
+                               RestAPIDeadlineExceeded is raised if the deadline is exceeded.
+
+        Note: This will return a future (an asyncio Task), that needs to be awaited or yield.
+        The request is sent right away, returning a future here allows you to control when
+        you wait for it.
         Please call this with keyword arguments
 
         Note that if you use _cache, DO NOT modify the output
 
         """
-        request = self._create_request(params=params)
+        _retry_policy = _retry_policy if _retry_policy is not None else self.retry_policy
+        request = self._create_request(params=params, retry_policy=_retry_policy)
         _retries_status = _retries_status if _retries_status is not None else self.retries_status
         _max_tries = _max_tries if _max_tries is not None else self.max_tries
-        # return a coroutine
-        return self._fetch_and_parse(request=request, retries_status=_retries_status, max_tries=_max_tries, cache=_cache)
+        # a task rather than the coroutine, so that the call starts without waiting to be awaited
+        return asyncio.ensure_future(self._fetch_and_parse(request=request, retries_status=_retries_status,
+                max_tries=_max_tries, cache=_cache, retry_policy=_retry_policy, deadline=_deadline))
+
+    def pages(self, **params):
+        """Iterate over the pages of this api
+
+        **params                the params of the first page, including the page size
+                                (i.e. limit=200) and the call options (i.e. _deadline=10)
+
+        return                  a PageIterator
+
+        Only available if the api was configured with "pagination".
+        """
+        if self.paginator is None:
+            raise RestAPIRuntimeException("{0} is not paginated".format(self.url))
+        return PageIterator(self, params)
 
-    @tornado.gen.coroutine
-    def _fetch_and_parse(self, request, retries_status, max_tries, cache):
+    def iterate(self, **params):
+        """Iterate over the items of all the pages of this api
+
+        **params                same as pages
+
+        return                  an ItemIterator
+        """
+        if self.paginator is None:
+            raise RestAPIRuntimeException("{0} is not paginated".format(self.url))
+        return ItemIterator(self, params)
+
+    def map(self, params_list, concurrency=10, ordered=False, **options):
+        """Call this api once per params, with at most {concurrency} calls in flight
+
+        params_list             an iterable of params, one dict per call
+        concurrency             the max number of calls in flight (default: 10)
+        ordered                 if True, the results are returned in the order of params_list,
+                                otherwise as they complete (default: False)
+        **options               the params and call options shared by all the calls
+                                (i.e. limit=200, _deadline=10), overridden by the params of a call
+
+        return                  a BulkIterator of BulkResult
+
+        Each BulkResult holds the response or the exception of its call, a failed call does
+        not stop the others. The calls still go through the rate limiter of this api.
+        """
+        return BulkIterator(self, params_list, concurrency=concurrency, ordered=ordered, options=options)
+
+    async def gather(self, params_list, concurrency=10, **options):
+        """Same as map, but wait for all the calls
+
+        return                  the list of BulkResult, in the order of params_list
+        """
+        results = []
+        iterator = self.map(params_list, concurrency=concurrency, ordered=True, **options)
+        result = await iterator.fetch_next()
+        while result is not None:
+            results.append(result)
+            result = await iterator.fetch_next()
+        return results
+
+    async def _fetch_and_parse(self, request, retries_status, max_tries, cache, retry_policy=None, deadline=None):
         """Fetch and parse
         return the response, do not do any processing except parsing
 
         please call this with keyword arguments
         """
         if cache is not None:
-            name_of_cache = cache[0]
-            time_to_cache = cache[1]
-            if name_of_cache in self.cache:
-                cached_data = self.cache[name_of_cache]
-                if cached_data["expiry"] < time.time():
-                    self.cache.pop(name_of_cache, None)
-                else:
-                    response = cached_data["response"]
-                    raise tornado.gen.Return(response)
-
-        response = yield _fetch_with_retries(request=request, http_client=self.http_client,
-            retries_status=retries_status, max_tries=max_tries)
-        if hasattr(response, "body") and response.body is not None and self.decode is not None:
-            response.decoded_body = response.body.decode(self.decode)
-
+            time_to_cache = cache[1] if isinstance(cache, (tuple, list)) else cache
+            response = await self.cache.fetch(ResponseCache.key_for(request), 60 * time_to_cache,
+                functools.partial(self._fetch_and_parse, request=request, retries_status=retries_status,
+                    max_tries=max_tries, cache=None, retry_policy=retry_policy, deadline=deadline))
+            return response
+
+        if self._middleware_chain is None:
+            response = await self._send(request, retries_status=retries_status, max_tries=max_tries,
+                    retry_policy=retry_policy, deadline=deadline)
+        else:
+            response = await self._middleware_chain(request, { "retries_status": retries_status,
+                "max_tries": max_tries, "retry_policy": retry_policy, "deadline": deadline })
         if response.code != 200:
             logging.warn(("Request error:\nURL: {}\nMethod: {}\nCode: {}\nBody: {}").format(
                     response.request.url, response.request.method, response.code, response.body))
 
+        response = self.response_class(response, decode=self.decode)
         for hook in self.post_response_hooks:
             hook(response)
 
-        if cache is not None:
-            cached_data = { "expiry" : time.time() + (60 * time_to_cache),
-                    "response": response }
-            self.cache[name_of_cache] = cached_data
-
-        raise tornado.gen.Return(response)
+        return response
+
+    def _send(self, request, retries_status, max_tries, retry_policy=None, deadline=None):
+        """Send the request, with retries"""
+        http_client = self.http_client if self.http_client is not None else tornado.httpclient.AsyncHTTPClient()
+        return _fetch_with_retries(request=request, http_client=http_client,
+            retries_status=retries_status, max_tries=max_tries, rate_limiter=self.rate_limiter,
+            retry_policy=retry_policy, deadline=deadline,
+            metrics=self.metrics.endpoint(self.url) if self.metrics is not None else None)
+
+    def _send_with_options(self, request, options):
+        return self._send(request, **options)
+
+    def _compose_middlewares(self):
+        """Compose the middlewares into a single function, so that calls do not rebuild the chain"""
+        if not self.middlewares:
+            self._middleware_chain = None
+            return
+        chain = self._send_with_options
+        for middleware in reversed(self.middlewares):
+            chain = functools.partial(middleware, fetch=chain)
+        self._middleware_chain = chain
 
     def request(self, **params):
         """Create a request with params
         """
         return self._create_request(params=params)
 
-    def _create_request(self, params):
+    def _create_request(self, params, retry_policy=None):
         """Internal method to create request
         """
-        for param_key, _ in six.iteritems(params):
-            if param_key in self._partial_values:
-                raise RestAPIRuntimeException("param {0} have been fixed".format(param_key))
-
-        actual_params = {}
-        actual_params.update(self._default_values)
-        actual_params.update(params)
-        actual_params.update(self._partial_values)
-
-        self._clean_and_check_if_ready(actual_params)
+        retry_policy = retry_policy if retry_policy is not None else self.retry_policy
+        actual_params = self._clean_and_check_if_ready(params)
         url = self._parse_url_and_pop_params(actual_params)
-        body = None
         # create the actual request
-        _r = { "method": self.method, "headers": {} }
-        _r["headers"].update(self.headers)
+        _r = { "method": self.method, "headers": dict(self.headers) }
 
+        # the params are sorted so that the same params always give the same request, and the
+        # same cache key (see ResponseCache.key_for) whatever the order they are passed in
         if self.method in (RestAPI.GET, RestAPI.DELETE): # if method is GET or POST, url params are added to url
-            url = tornado.httputil.url_concat(url, actual_params)
+            if "?" in url:
+                url = tornado.httputil.url_concat(url, sorted(actual_params.items()))
+            elif actual_params:
+                url = url + "?" + tornado.httputil.urlencode(sorted(actual_params.items()))
+        elif self.request_body_type == RestAPI.FORM:
+            _r["body"] = tornado.httputil.urlencode(sorted(actual_params.items()))
         else:
-            if self.request_body_type == RestAPI.FORM:
-                body = tornado.httputil.urlencode(actual_params)
-            else:
-                body = json.dumps(actual_params)
-                _r["headers"]["content-type"] = "application/json"
+            _r["body"] = json.dumps(actual_params, sort_keys=True)
+            _r["headers"]["content-type"] = "application/json"
 
         _r["url"] = url
         if self.auth_username is not None and self.auth_password is not None:
             _r["auth_username"] = self.auth_username
             _r["auth_password"] = self.auth_password
 
-        if body is not None:
-            _r["body"] = body
+        if retry_policy.connect_timeout is not None:
+            _r["connect_timeout"] = retry_policy.connect_timeout
+        if retry_policy.request_timeout is not None:
+            _r["request_timeout"] = retry_policy.request_timeout
 
         request = tornado.httpclient.HTTPRequest(**_r)
         return request
 
-    def _clean_and_check_if_ready(self, actual_params):
-        """Check if the request is ready to be called
+    def _clean_and_check_if_ready(self, params):
+        """Check if the request is ready to be called, and merge the params with the
+        default and partial values
 
         raise RestAPIRuntimeException if not enough param is passed to create the request
+
+        return                  the actual params of the request
         """
         if self.host is None:
             raise RestAPIRuntimeException("host is not set")
+        if not self._allowed_params.issuperset(params):
+            key = next(key for key in params if key not in self._allowed_params)
+            raise RestAPIRuntimeException("{0} is not a valid param".format(key))
+
+        actual_params = dict(self._base_values)
+        converters = self._converters
+        partial_values = self._partial_values
+        for key, value in six.iteritems(params):
+            if key in partial_values:
+                raise RestAPIRuntimeException("param {0} have been fixed".format(key))
+            if value is not None:
+                convert = converters.get(key)
+                if convert is not None:
+                    value = convert(value)
+            actual_params[key] = value
+
+        if not self._required_params.issubset(actual_params):
+            key = next(key for key in self._required_params if key not in actual_params)
+            raise RestAPIRuntimeException("param {0} is required".format(key))
+        return actual_params
+
+    def _compile(self):
+        """Compile the params definitions into converters.
+
+        This is done once when the api is created, so that each call only does a single pass
+        over the params passed to it.
+        """
+        self._converters = {}
         for key, param in six.iteritems(self.params):
-            if param.get("is_required") and key not in actual_params:
-                raise RestAPIRuntimeException("param {0} is required".format(key))
-
-            if actual_params.get(key) is not None:
-                old_value = actual_params[key]
-                new_value = self._check_type_and_value_for_param(key, old_value, param)
-                actual_params[key] = new_value
-
-        for key in list(actual_params.keys()):
-            if key not in self.params and key not in self.url_params:
-                raise RestAPIRuntimeException("{0} is not a valid param".format(key))
-
-    def _check_type_and_value_for_param(self, key, value, param):
-        if param.get("type") is not None:
-            param_type = param.get("type")
-            if param_type in RestAPI.PARAM_TYPES:
-                if param_type == "string":
-                    try:
-                        value = str(value)
-                    except ValueError:
-                        raise RestAPIRuntimeException("{0} cannot be converted to a string".format(value))
-                elif param_type == "int":
-                    try:
-                        value = int(value)
-                    except ValueError:
-                        raise RestAPIRuntimeException("{0} cannot be converted to a int".format(value))
-                elif param_type == "float":
-                    try:
-                        value = float(value)
-                    except ValueError:
-                        raise RestAPIRuntimeException("{0} cannot be converted to a float".format(value))
-                elif param_type == "dict":
-                    if not isinstance(value, dict):
-                        raise RestAPIRuntimeException("{0} is not a dictionary".format(value))
-                elif param_type == "list":
-                    if not isinstance(value, list):
-                        raise RestAPIRuntimeException("{0} is not a list".format(value))
-                elif param_type == "bool":
-                    if not isinstance(value, bool):
-                        raise RestAPIRuntimeException("{0} is not a boolean".format(value))
-                elif param_type == "comma_string":
-                    if isinstance(value, str):
-                        pass
-                    elif isinstance(value, list):
-                        try:
-                            value = ",".join(value)
-                        except ValueError:
-                            raise RestAPIRuntimeException("{0} cannot be converted to a comma separated string".format(value))
-                elif param_type == "bool_string":
-                    if isinstance(value, str):
-                        value_lowered = value.lower()
-                        if value_lowered not in {"true", "false"}:
-                            raise RestAPIRuntimeException("{0} is not valid bool_string value".format(value))
-                        value = value_lowered
-                    elif isinstance(value, bool):
-                        value = { True: "true", False: "false" }.get(value)
-                    else:
-                        raise RestAPIRuntimeException("{0} is not valid bool_string value".format(value))
-
-                elif callable(param_type):
-                    value = param_type(callable)
-
-        if value is not None:
-            if param.get("choices") is not None:
-                if not value in param.get("choices"):
-                    raise RestAPIRuntimeException("{0} not is not a valid value for {1}".format(value, key))
-
-        return value
+            convert = _compile_param(key, param)
+            if convert is not None:
+                self._converters[key] = convert
+        self._required_params = frozenset(key for key, param in six.iteritems(self.params)
+                if param.get("is_required"))
+        self._allowed_params = frozenset(self.params).union(self.url_params)
+        self._merge_values()
+
+    def _merge_values(self):
+        """Merge the default and partial values, this needs to be called when they change"""
+        base_values = {}
+        for values in (self._default_values, self._partial_values):
+            for key, value in six.iteritems(values):
+                convert = self._converters.get(key)
+                if value is not None and convert is not None:
+                    value = convert(value)
+                base_values[key] = value
+        self._base_values = base_values
 
     def _parse_url_and_pop_params(self, actual_params):
+        if not self.url_params:
+            return "{protocol}://{host}{url}".format(protocol=self.protocol, host=self.host, url=self.url)
         url_params = {}
         for param in self.url_params:
             if param not in actual_params:
@@ -477,11 +1936,7 @@ def parse_json_if_status(status_code=None, key="parsed_body"):
     status_code = status_code if status_code is not None else { 200 }
     def _parse(response):
         if response.code in status_code:
-            if hasattr(response, "decoded_body"):
-                body = response.decoded_body
-            else:
-                body = response.body
-            response.json_body = json.loads(body)
+            response.json_body = json_loads(response.body)
         else:
             response.json_body = None
     return _parse
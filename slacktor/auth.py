@@ -7,6 +7,7 @@ _API = {
     "test": {
         "url": "/api/auth.test",
         "method": "GET",
+        "rate_tier": 4,
         "params": {
             "token": { "type": "string", "is_required": True },
         },
@@ -16,5 +17,5 @@ _API = {
 
 class AuthAPI(_GenericAPI):
 
-    def __init__(self, token):
-        super().__init__(token, _API)
+    def __init__(self, token, http_client=None):
+        super().__init__(token, _API, http_client=http_client)
@@ -7,16 +7,21 @@ _API = {
     "list": {
         "url": "/api/channels.list",
         "method": "GET",
+        "rate_tier": 2,
         "params": {
             "token": { "type": "string", "is_required": True },
             "exclude_archived": { "type": "bool_string" },
             "exclude_members": { "type": "bool_string" },
+            "cursor": { "type": "string" },
+            "limit": { "type": "int" },
         },
+        "pagination": { "type": "cursor", "items": "channels", "page_size": 200 },
         "parse_data": ("channels", )
     },
     "history": {
         "url": "/api/channels.history",
         "method": "GET",
+        "rate_tier": 3,
         "params": {
             "token": { "type": "string", "is_required": True },
             "channel": { "type": "string", "is_required": True },
@@ -25,10 +30,12 @@ _API = {
             "inclusive": { "type": "bool_string" },
             "count": { "type": "int" },
             "unreads": { "type": "bool_string" },
-        }
+        },
+        "pagination": { "type": "latest", "items": "messages", "page_size": 200 },
+        "parse_data": ("messages", "has_more")
     }
 }
 class ChannelsAPI(_GenericAPI):
 
-    def __init__(self, token):
-        super().__init__(token, _API)
+    def __init__(self, token, http_client=None):
+        super().__init__(token, _API, http_client=http_client)
@@ -7,6 +7,7 @@ _API = {
     "post_message": {
         "url": "/api/chat.postMessage",
         "method": "POST",
+        # limited per channel, not per token, see RATE_TIERS
         "params": {
             "token": { "type": "string", "is_required": True },
             "channel": { "type": "string", "is_required": True },
@@ -23,5 +24,5 @@ _API = {
 
 class ChatAPI(_GenericAPI):
 
-    def __init__(self, token):
-        super().__init__(token, _API)
+    def __init__(self, token, http_client=None):
+        super().__init__(token, _API, http_client=http_client)
@@ -0,0 +1,23 @@
+
+import functools
+from . import _GenericAPI
+from .api_wrapper import RestAPI
+
+_API = {
+    "info": {
+        "url": "/api/conversations.info",
+        "method": "GET",
+        "rate_tier": 3,
+        "params": {
+            "token": { "type": "string", "is_required": True },
+            "channel": { "type": "string", "is_required": True },
+            "include_locale": { "type": "bool_string" },
+            "include_num_members": { "type": "bool_string" },
+        },
+        "parse_data": ("channel", )
+    },
+}
+class ConversationsAPI(_GenericAPI):
+
+    def __init__(self, token, http_client=None):
+        super().__init__(token, _API, http_client=http_client)
@@ -7,6 +7,7 @@ _API = {
     "connect": {
         "url": "/api/rtm.connect",
         "method": "POST",
+        "rate_tier": 1,
         "params": {
             "token": { "type": "string", "is_required": True },
         },
@@ -16,6 +17,6 @@ _API = {
 
 class RealTimeMessagingAPI(_GenericAPI):
 
-    def __init__(self, token):
-        super().__init__(token, _API)
+    def __init__(self, token, http_client=None):
+        super().__init__(token, _API, http_client=http_client)
 
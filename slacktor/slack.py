@@ -1,14 +1,147 @@
+import importlib
+
+from .api_wrapper import RateLimitScheduler, HTTPClientPool
+
+# the apis of slack.api, name -> (module, class), the modules are imported on first use
+API_CLASSES = {
+    "channels": ("channels", "ChannelsAPI"),
+    "conversations": ("conversations", "ConversationsAPI"),
+    "users": ("users", "UsersAPI"),
+    "chat": ("chat", "ChatAPI"),
+    "rtm": ("rtm", "RealTimeMessagingAPI"),
+    "auth": ("auth", "AuthAPI"),
+}
+
+
+class APINamespace(object):
+    """slack.api, the apis are created on first access, i.e. slack.api.chat"""
+
+    def __init__(self, slack):
+        self._slack = slack
+        # name -> _GenericAPI, the apis created so far
+        self._apis = {}
+
+    def __getattr__(self, name):
+        # only called when the api is not created yet
+        if name.startswith("_") or name not in API_CLASSES:
+            raise AttributeError(name)
+        module_name, class_name = API_CLASSES[name]
+        module = importlib.import_module("." + module_name, __package__)
+        api = getattr(module, class_name)(self._slack.token, http_client=self._slack.http_client)
+        if self._slack.middlewares:
+            api.set_middlewares(self._slack.middlewares)
+        setattr(self, name, api)
+        self._apis[name] = api
+        return api
 
-import types
-from . import channels, users, chat, rtm, auth
 
 class Slack(object):
+    """
+    token               the slack api token
+    http_client         the http client used by all the apis, either a HTTPClientPool or an
+                        AsyncHTTPClient to wrap in one (default: None, a HTTPClientPool is created)
+    max_concurrency     the max number of requests in flight (default: 10)
+    max_per_host        the max number of requests in flight per host, an int or { host: limit }
+                        (default: None, no limit)
+    keepalive           keep connections open between requests (default: True)
+
+    The apis of slack.api (see API_CLASSES) and their endpoints are created on first access,
+    so a script only pays for the endpoints it calls.
+    """
+
+    def __init__(self, token, http_client=None, max_concurrency=10, max_per_host=None, keepalive=True):
+        if not isinstance(http_client, HTTPClientPool):
+            http_client = HTTPClientPool(http_client=http_client, max_concurrency=max_concurrency,
+                    max_per_host=max_per_host, keepalive=keepalive)
+        self.http_client = http_client
+        self.token = token
+        self.middlewares = []
+        self.api = APINamespace(self)
+        # the rate limit buckets shared by all the apis of this token
+        self.rate_limiter = RateLimitScheduler.for_key(token)
+
+    def apis(self):
+        """All the apis of slack.api, creating them if necessary"""
+        return [ getattr(self.api, name) for name in API_CLASSES ]
+
+    def add_middleware(self, middleware):
+        """Add a middleware to all the apis, see RestAPI.add_middleware"""
+        self.middlewares.append(middleware)
+        for api in self.api._apis.values():
+            api.add_middleware(middleware)
+        return self
+
+    def set_middlewares(self, middlewares):
+        """Replace the middlewares of all the apis, see RestAPI.add_middleware"""
+        self.middlewares = list(middlewares)
+        for api in self.api._apis.values():
+            api.set_middlewares(middlewares)
+        return self
+
+
+class SlackPool(object):
+    """Slack objects for many tokens (i.e. one per workspace), sharing one HTTPClientPool
+
+    http_client         the http client shared by all the tokens, either a HTTPClientPool or an
+                        AsyncHTTPClient to wrap in one (default: None, a HTTPClientPool is created)
+    max_concurrency     the max number of requests in flight, for all the tokens (default: 50)
+    max_per_host        the max number of requests in flight per host, an int or { host: limit }
+                        (default: None, no limit)
+    keepalive           keep connections open between requests (default: True)
+
+    The endpoint definitions are compiled once and shared by all the tokens, so a token only
+    adds its own RestAPI copies and rate limit buckets. The responses cached with _cache
+    are keyed by request, which includes the token, so the tokens never share a response.
+
+        pool = SlackPool()
+        response = yield pool[token].api.users.info(user=user_id)
+    """
+
+    def __init__(self, http_client=None, max_concurrency=50, max_per_host=None, keepalive=True):
+        if not isinstance(http_client, HTTPClientPool):
+            http_client = HTTPClientPool(http_client=http_client, max_concurrency=max_concurrency,
+                    max_per_host=max_per_host, keepalive=keepalive)
+        self.http_client = http_client
+        self.middlewares = []
+        self._clients = {} # token -> Slack
+
+    def get(self, token):
+        """Get the Slack object of a token, creating it if necessary"""
+        slack = self._clients.get(token)
+        if slack is None:
+            slack = self._clients[token] = Slack(token, http_client=self.http_client)
+            if self.middlewares:
+                slack.set_middlewares(self.middlewares)
+        return slack
+
+    __getitem__ = get
+
+    def remove(self, token):
+        """Forget a token, i.e. when the app is uninstalled from a workspace
+
+        return              the Slack object of the token, or None if there was none
+        """
+        RateLimitScheduler.discard(token)
+        return self._clients.pop(token, None)
+
+    def tokens(self):
+        return list(self._clients)
+
+    def __contains__(self, token):
+        return token in self._clients
+
+    def __len__(self):
+        return len(self._clients)
 
-    def __init__(self, token):
-        self.api = types.SimpleNamespace()
-        self.api.channels = channels.ChannelsAPI(token)
-        self.api.users = users.UsersAPI(token)
-        self.api.chat = chat.ChatAPI(token)
-        self.api.rtm = rtm.RealTimeMessagingAPI(token)
-        self.api.auth = auth.AuthAPI(token)
+    def add_middleware(self, middleware):
+        """Add a middleware to the apis of all the tokens, including the ones added later"""
+        self.middlewares.append(middleware)
+        for slack in self._clients.values():
+            slack.add_middleware(middleware)
+        return self
 
+    def stats(self):
+        return {
+            "tokens": len(self._clients),
+            "http_client": self.http_client.stats(),
+        }
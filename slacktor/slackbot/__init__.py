@@ -1,69 +1,269 @@
 
-import re
 import uuid
-import json
-import types
+import time
+import importlib
 import logging
 import functools
 
-import tornado.gen
-import tornado.options
-import tornado.httputil
-import tornado.httpclient
-import tornado.websocket
+import tornado.ioloop
+
+from ..api_wrapper import json_loads
+from .dispatcher import EventDispatcher
+from .connection import RTMConnection, sniff_frame_type
+from .sender import MessageSender
+from .process_pool import ProcessPool
 
 class SlackBot(object):
+    """
+    slack               the Slack object
+    http_client         the http client (default: None, use the one of slack)
+    workers             the number of event handlers that can run at the same time (default: 4)
+    queue_size          the max number of events waiting to be handled per worker (default: 1000)
+    ordered             if True, the events of a channel are handled in order (default: True)
+    ping_interval       the interval between rtm pings (in seconds), 0 to disable (default: 30)
+    backfill            if True, the messages missed while reconnecting are fetched from
+                        channels.history and dispatched before the new events (default: True)
+    backfill_limit      the max number of messages to backfill per channel (default: 1000)
+    backfill_channels   the max number of channels to backfill, the most recently active ones
+                        (default: 100)
+    backfill_max_idle   the channels without messages for longer than this are not backfilled
+                        anymore (in seconds) (default: 86400)
+    backfill_concurrency
+                        the max number of channels.history calls in flight while backfilling
+                        (default: 4)
+    post_interval       the min time between 2 messages posted to a channel by post_message
+                        (in seconds) (default: 1)
+    processes           the number of worker processes of the cpu bound listeners
+                        (default: None, the number of CPUs)
+    max_in_flight       the max number of cpu bound listeners running at the same time
+                        (default: None, 2 per process)
+
+    Websocket frames are only parsed if someone listens to their type. The type is read from
+    the start of the raw frame, and frames that do not start with their type are always parsed.
+    """
 
-    def __init__(self, slack, http_client=None):
+    # events handled by the bot itself
+    INTERNAL_EVENTS = frozenset(("goodbye", ))
+    # the channels.history errors of the channels that cannot be backfilled
+    # (not a public channel, or we are not in it anymore)
+    UNREADABLE_CHANNEL_ERRORS = frozenset(("channel_not_found", "not_in_channel"))
+
+    def __init__(self, slack, http_client=None, workers=4, queue_size=1000, ordered=True,
+            ping_interval=30, backfill=True, backfill_limit=1000, post_interval=1.0, processes=None,
+            max_in_flight=None, backfill_channels=100, backfill_max_idle=86400, backfill_concurrency=4):
         self.slack = slack
-        self.http_client = http_client or tornado.httpclient.AsyncHTTPClient()
+        self.http_client = http_client or slack.http_client
 
         self.listeners = {}
+        # the event types with at least one listener, None for the wildcard
+        self.subscribed_events = set()
+        self.dispatcher = EventDispatcher(self._get_handlers, workers=workers,
+                queue_size=queue_size, ordered=ordered)
+        self.connection = RTMConnection(slack, ping_interval=ping_interval,
+                on_reconnect=self._backfill if backfill else None)
+        self.backfill = backfill
+        self.backfill_limit = backfill_limit
+        self.backfill_channels = backfill_channels
+        self.backfill_max_idle = backfill_max_idle
+        self.backfill_concurrency = backfill_concurrency
+        # public channel -> ts of the last message seen, used for backfill
+        self.last_seen = {}
+        self.sender = MessageSender(slack, interval=post_interval)
+        self.process_pool = ProcessPool(processes=processes, max_in_flight=max_in_flight)
 
-    @tornado.gen.coroutine
-    def _get_connection(self):
-        connection = None
-        tries = 0
-        while connection is None and tries < 3:
-            response = yield self.slack.api.rtm.connect()
-            if response.code == 200 and response.data.ok:
-                connection = yield tornado.websocket.websocket_connect(response.data.url)
-                break
-            tries += 1
-        return connection
+        # stats
+        self.backfilled = 0
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.frames_dispatched = 0
+        self.events_pushed = 0
 
-    @tornado.gen.coroutine
-    def websocket_watch(self):
+    async def websocket_watch(self):
         """
         Watch for events using websocket
         """
-        connection = yield self._get_connection()
-        while connection:
-            msg = yield connection.read_message()
+        connected = await self.connection.connect()
+        while connected:
+            msg = await self.connection.read_message()
+            if msg is None: # stop was called
+                break
+            self.frames_received += 1
+            if not self._is_frame_wanted(msg):
+                self.frames_dropped += 1
+                continue
             try:
-                msg = json.loads(msg)
+                msg = json_loads(msg)
             except Exception as e:
                 import traceback; traceback.print_exc()
                 continue
 
-            self._fire_event(None, msg)
-            self._fire_event(msg["type"], msg)
-            if msg["type"] == "goodbye":
+            if self.backfill and not self._track_message(msg):
+                continue # already dispatched by the backfill
+            self.frames_dispatched += 1
+            # this blocks when the handlers are falling behind
+            await self.dispatcher.dispatch(msg)
+            if msg.get("type") == "goodbye":
                 logging.info("Reconnecting")
-                connection = yield self._get_connection()
+                self.connection.reconnect()
+
+    async def dispatch_event(self, event):
+        """Hand an event received outside of the rtm websocket to the listeners, i.e. from
+        the Events API (see events_api.EventsAPIReceiver)
+        """
+        self.events_pushed += 1
+        # the events api does not keep the order of the events, so they are not tracked for
+        # backfill, the duplicates are dropped by the receiver
+        await self.dispatcher.dispatch(event)
 
-    def _fire_event(self, event_name, event):
-        handlers = self.listeners.get(event_name)
-        if handlers:
-            for handler in handlers.values():
-                handler(event)
+    def stop(self):
+        """Stop watching, websocket_watch returns once the connection is closed"""
+        self.connection.close()
 
-    def add_event_listener(self, event_name, func, name=None):
+    def _track_message(self, event):
+        """Record the ts of the last message of each public channel
+
+        return          False if the message is older than the last message seen
+        """
+        if event.get("type") != "message" or "ts" not in event or not isinstance(event.get("channel"), str):
+            return True
+        # only public channels can be backfilled with channels.history, do not track dms and groups
+        if not event["channel"].startswith("C"):
+            return True
+        last_ts = self.last_seen.get(event["channel"])
+        if last_ts is not None and float(event["ts"]) <= float(last_ts):
+            return False
+        self.last_seen[event["channel"]] = event["ts"]
+        return True
+
+    def _channels_to_backfill(self):
+        """Forget the idle channels, and return the (channel, last ts) of the most recently
+        active channels
+        """
+        min_ts = time.time() - self.backfill_max_idle
+        for channel in [ channel for channel, ts in self.last_seen.items() if float(ts) < min_ts ]:
+            del self.last_seen[channel]
+        channels = sorted(self.last_seen.items(), key=lambda item: float(item[1]), reverse=True)
+        return channels[:self.backfill_channels]
+
+    async def _backfill(self):
+        """Dispatch the messages that were missed while reconnecting, oldest first"""
+        history = self.slack.api.channels.history
+        count = min(self.backfill_limit, 1000)
+        params_list = [ { "channel": channel, "oldest": last_ts, "count": count }
+                for channel, last_ts in self._channels_to_backfill() ]
+        results = history.map(params_list, concurrency=self.backfill_concurrency)
+        result = await results.fetch_next()
+        while result is not None:
+            channel = result.params["channel"]
+            if not result.ok or not result.response.data.ok:
+                if result.ok and result.response.data.error in SlackBot.UNREADABLE_CHANNEL_ERRORS:
+                    self.last_seen.pop(channel, None)
+                # else a transient error (i.e. 429, 5xx, deadline), keep the channel
+            else:
+                messages = await self._fetch_missed(history, result.params, result.response.data)
+                for message in reversed(messages[:self.backfill_limit]):
+                    message.setdefault("type", "message")
+                    message["channel"] = channel
+                    if self._track_message(message):
+                        self.backfilled += 1
+                        await self.dispatcher.dispatch(message)
+            result = await results.fetch_next()
+
+    async def _fetch_missed(self, history, params, data):
+        """Fetch the pages after the first page of channels.history, up to backfill_limit messages
+
+        return          the messages, newest first
+        """
+        messages = list(data.messages or ())
+        if not data.has_more or not messages or len(messages) >= self.backfill_limit:
+            return messages
+        pages = history.pages(latest=messages[-1]["ts"], **params)
+        response = await pages.fetch_next()
+        while response is not None and len(messages) < self.backfill_limit:
+            if response.code != 200 or not response.data.ok:
+                break
+            messages.extend(response.data.messages)
+            response = await pages.fetch_next()
+        return messages
+
+    def _is_frame_wanted(self, frame):
+        """Check if anyone listens to this frame, without parsing it"""
+        if None in self.subscribed_events:
+            return True
+        event_type = sniff_frame_type(frame)
+        if event_type is None:
+            return True
+        return event_type in self.subscribed_events or event_type in SlackBot.INTERNAL_EVENTS
+
+    def post_message(self, channel, text=None, thread_ts=None, **params):
+        """Post a message through the per channel queue of the bot, see MessageSender.send
+
+        return              a future of the response
+        """
+        return self.sender.send(channel, text=text, thread_ts=thread_ts, **params)
+
+    def run_in_process(self, func):
+        """Wrap a cpu bound listener so that it runs in the process pool of the bot
+
+        The wrapper takes the same args as func, hands the call to the pool and returns None, so
+        the dispatcher workers do not wait for the processes and only the pool limits how many
+        calls run at the same time. func is called in a worker process (see ProcessPool), and
+        what it returns is posted with post_message: a dict of the params of chat.post_message,
+        a list of them, or None to post nothing. Exceptions raised by func are printed.
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tornado.ioloop.IOLoop.current().spawn_callback(self._run_in_process, func, args, kwargs)
+        return wrapper
+
+    async def _run_in_process(self, func, args, kwargs):
+        try:
+            result = await self.process_pool.run(func, *args, **kwargs)
+        except Exception as e:
+            import traceback; traceback.print_exc()
+            return
+        if result is None:
+            return
+        # the posts are paced by the sender, do not wait for them
+        for params in (result if isinstance(result, (list, tuple)) else [ result ]):
+            self.post_message(**params)
+
+    def stats(self):
+        return {
+            "frames_received": self.frames_received,
+            "frames_dropped": self.frames_dropped,
+            "frames_dispatched": self.frames_dispatched,
+            "events_pushed": self.events_pushed,
+            "backfilled": self.backfilled,
+            "connection": self.connection.stats(),
+            "dispatcher": self.dispatcher.stats(),
+            "sender": self.sender.stats(),
+            "process_pool": self.process_pool.stats(),
+        }
+
+    def _get_handlers(self, event):
+        handlers = []
+        event_type = event.get("type")
+        # frames without a type (i.e. message acks) only go to the wildcard listeners, once
+        for event_name in (None, ) if event_type is None else (None, event_type):
+            listeners = self.listeners.get(event_name)
+            if listeners:
+                handlers.extend(listeners.items())
+        return handlers
+
+    def add_event_listener(self, event_name, func, name=None, cpu_bound=False):
+        """
+        cpu_bound           if True, func runs in a worker process and what it returns is
+                            posted, see run_in_process (default: False)
+        """
         name = name or uuid.uuid4()
+        if cpu_bound:
+            func = self.run_in_process(func)
         if event_name not in self.listeners:
             self.listeners[event_name] = {}
 
         self.listeners[event_name][name] = func
+        self.subscribed_events.add(event_name)
         return name
 
     def remove_event_listener(self, event_name, name):
@@ -71,7 +271,19 @@ class SlackBot(object):
             return None
         if name not in self.listeners[event_name]:
             return None
-        return self.listeners[event_name].pop(name)
+        func = self.listeners[event_name].pop(name)
+        if not self.listeners[event_name]:
+            self.subscribed_events.discard(event_name)
+        return func
 
 from . import extensions
-from . import cache
+from . import dispatcher
+from . import connection
+from . import sender
+from . import process_pool
+
+def __getattr__(name):
+    # cache, directory and events_api are imported on first use, see __getattr__ of modules (PEP 562)
+    if name in ("cache", "directory", "events_api"):
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
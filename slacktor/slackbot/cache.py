@@ -1,61 +1,520 @@
 
+import os
+import time
+import logging
+import asyncio
+import sqlite3
+
 import tornado.gen
+import tornado.ioloop
+import tornado.concurrent
+
+from ..api_wrapper import RestAPIRuntimeException
+from .directory import (UserRecord, ChannelRecord, FieldView, MemberView,
+        user_directory, channel_directory)
 
 class Cache(object):
+    """Map users and channels names to ids
+
+    The cache is filled by fetch_all. To keep it up to date, either call watch, which applies
+    the rtm events as they come, or autofetch, which periodically reloads everything.
+
+    Users and channels are stored once, as UserRecord and ChannelRecord, in directories
+    indexed by id, name, lower case name, display name and email (see directory.py).
+    The name/id maps are read only views over the directories.
+
+    resolve_user and resolve_channel fetch the users and channels that are missing, i.e. a
+    user that joined after the last reload, with users.info and conversations.info.
+
+    The cache can be saved to a snapshot file, which is loaded on the next start so that the
+    lookups work right away while the cache is refreshed in the background (see start).
+    """
+
+    # bump this when the content of the snapshot changes, older snapshots are ignored
+    SNAPSHOT_VERSION = 2
+
+    # the rtm events used by watch, and the method applying them
+    EVENT_HANDLERS = {
+        "channel_created": "_on_channel_created",
+        "channel_rename": "_on_channel_rename",
+        "channel_deleted": "_on_channel_deleted",
+        "channel_joined": "_on_channel_joined",
+        "channel_left": "_on_channel_left",
+        "team_join": "_on_user_change",
+        "user_change": "_on_user_change",
+    }
+    # the delay between full reloads when the cache is watching the rtm events (in minutes)
+    CONSISTENCY_SWEEP_DELAY = 24 * 60
+    # the time resolve_* waits to batch the missing ids together (in seconds)
+    RESOLVE_BATCH_DELAY = 0.05
+    # the time an id that cannot be resolved is remembered as missing (in seconds)
+    RESOLVE_MISSING_TTL = 60
 
     def __init__(self, slack):
         self.slack = slack
-        self.channel_name_to_id = {}
-        self.channel_is_in = set()
-        self.channel_id_to_name = {}
-        self.user_name_to_id = {}
-        self.user_id_to_name = {}
+        self.users = user_directory()
+        self.channels = channel_directory()
+        self.user_resolver = Resolver(self._fetch_user, self.RESOLVE_BATCH_DELAY, self.RESOLVE_MISSING_TTL)
+        self.channel_resolver = Resolver(self._fetch_channel, self.RESOLVE_BATCH_DELAY,
+                self.RESOLVE_MISSING_TTL)
+        self.watching = False
+        self.autofetch_enabled = False
+        # the time (time.time()) the data was fetched from slack, None if never fetched
+        self.updated_at = None
+
+        # stats
+        self.events_applied = 0
+        self.full_reloads = 0
+
+    @property
+    def age(self):
+        """The age of the data (in seconds), None if it was never fetched
+
+        After loading a snapshot, this is the age of the snapshot until the next fetch_all.
+        """
+        return time.time() - self.updated_at if self.updated_at is not None else None
+
+    @property
+    def channel_name_to_id(self):
+        return FieldView(self.channels.indexes["name"], "id")
+
+    @property
+    def channel_id_to_name(self):
+        return FieldView(self.channels.by_id, "name")
+
+    @property
+    def channel_is_in(self):
+        return MemberView(self.channels)
+
+    @property
+    def user_name_to_id(self):
+        return FieldView(self.users.indexes["name"], "id")
+
+    @property
+    def user_id_to_name(self):
+        return FieldView(self.users.by_id, "name")
 
     def get_channel_id_from_name(self, name):
-        return self.channel_name_to_id.get(name)
+        channel = self.channels.find("name", name)
+        return channel.id if channel is not None else None
 
     def get_channel_name_from_id(self, id):
-        return self.channel_id_to_name.get(id)
+        channel = self.channels.get(id)
+        return channel.name if channel is not None else None
 
     def get_user_id_from_name(self, name):
-        return self.user_name_to_id.get(name)
+        user = self.users.find("name", name)
+        return user.id if user is not None else None
 
     def get_user_name_from_id(self, id):
-        return self.user_id_to_name.get(id)
-
-    @tornado.gen.coroutine
-    def reload_channels_cache(self):
-        response = yield self.slack.api.channels.list(exclude_members=True)
-        if response.code == 200 and response.data.ok:
-            self.channel_name_to_id = { channel["name"]: channel["id"] for channel in response.data.channels }
-            self.channel_id_to_name = { channel["id"]: channel["name"] for channel in response.data.channels }
-            self.channel_is_in = { channel["id"] for channel in response.data.channels if channel["is_member"] }
-
-    @tornado.gen.coroutine
-    def reload_users_cache(self):
-        response = yield self.slack.api.users.list(presence=False)
-        if response.code == 200 and response.data.ok:
-            self.user_name_to_id = { member["name"]: member["id"] for member in response.data.members }
-            self.user_id_to_name = { member["id"]: member["name"] for member in response.data.members }
-
-    @tornado.gen.coroutine
-    def autofetch(self, delay=60):
+        user = self.users.get(id)
+        return user.name if user is not None else None
+
+    def get_user(self, id):
+        return self.users.get(id)
+
+    def get_user_by_email(self, email):
+        return self.users.find("email", email.lower())
+
+    def get_user_by_display_name(self, display_name):
+        return self.users.find("display_name", display_name.lower())
+
+    def get_user_by_name(self, name, ignore_case=False):
+        if ignore_case:
+            return self.users.find("lower_name", name.lower())
+        return self.users.find("name", name)
+
+    def get_channel(self, id):
+        return self.channels.get(id)
+
+    def search_users(self, prefix, limit=10):
+        """Find the users whose name starts with prefix, ignoring case"""
+        return self.users.search(prefix, limit=limit)
+
+    def search_channels(self, prefix, limit=10):
+        """Find the channels whose name starts with prefix, ignoring case"""
+        return self.channels.search(prefix, limit=limit)
+
+    async def resolve_user(self, id):
+        """Get a user, fetching it with users.info if it is not in the cache
+
+        return              the UserRecord, or None if the user cannot be found
+        """
+        user = self.users.get(id)
+        if user is None:
+            user = await self.user_resolver.resolve(id)
+        return user
+
+    async def resolve_channel(self, id):
+        """Get a channel, fetching it with conversations.info if it is not in the cache
+
+        return              the ChannelRecord, or None if the channel cannot be found
+        """
+        channel = self.channels.get(id)
+        if channel is None:
+            channel = await self.channel_resolver.resolve(id)
+        return channel
+
+    def stats(self):
+        return {
+            "users": len(self.users),
+            "channels": len(self.channels),
+            "age": self.age,
+            "events_applied": self.events_applied,
+            "full_reloads": self.full_reloads,
+            "user_resolver": self.user_resolver.stats(),
+            "channel_resolver": self.channel_resolver.stats(),
+        }
+
+    async def reload_channels_cache(self, page_size=200):
+        """Reload the channels, one page at a time
+
+        The cache is only replaced once all the pages are fetched successfully.
+
+        return              True if the cache was replaced
+        """
+        channels = channel_directory()
+        pages = self.slack.api.channels.list.pages(exclude_members=True, limit=page_size)
+        response = await pages.fetch_next()
+        while response is not None:
+            if response.code != 200 or not response.data.ok:
+                return False
+            for channel in response.data.channels:
+                channels.add(ChannelRecord.from_channel(channel))
+            response = await pages.fetch_next()
+        self.channels = channels
+        return True
+
+    async def reload_users_cache(self, page_size=200):
+        """Reload the users, one page at a time
+
+        The cache is only replaced once all the pages are fetched successfully.
+
+        return              True if the cache was replaced
+        """
+        users = user_directory()
+        pages = self.slack.api.users.list.pages(presence=False, limit=page_size)
+        response = await pages.fetch_next()
+        while response is not None:
+            if response.code != 200 or not response.data.ok:
+                return False
+            for member in response.data.members:
+                users.add(UserRecord.from_member(member))
+            response = await pages.fetch_next()
+        self.users = users
+        return True
+
+    def watch(self, slackbot):
+        """Keep the cache up to date using the rtm events of slackbot
+
+        Each event is applied directly to the maps, so full reloads are only needed as a
+        rare consistency sweep (see autofetch).
+        """
+        for event_name, method in self.EVENT_HANDLERS.items():
+            slackbot.add_event_listener(event_name, getattr(self, method),
+                    name="cache.{0}".format(event_name))
+        self.watching = True
+
+    def unwatch(self, slackbot):
+        for event_name in self.EVENT_HANDLERS:
+            slackbot.remove_event_listener(event_name, "cache.{0}".format(event_name))
+        self.watching = False
+
+    async def autofetch(self, delay=None):
         """Autofetch caches every {delay} minutes
+
+        delay           the delay between reloads (in minutes)
+                        (default: 60, or CONSISTENCY_SWEEP_DELAY if the cache is watching events)
         """
         self.autofetch_enabled = True
-        interval = 1
+        interval = 0
         while self.autofetch_enabled:
             # this allows autofetch to be disabled at a 1 minute delay rather than 60 minutes
-            if interval % delay == 0:
-                yield self.fetch_all()
-                interval = 1
-            yield tornado.gen.sleep(60) # sleep 60 seconds
+            await tornado.gen.sleep(60) # sleep 60 seconds
+            interval += 1
+            if interval >= (delay or (self.CONSISTENCY_SWEEP_DELAY if self.watching else 60)):
+                await self.fetch_all()
+                interval = 0
+
+    async def fetch_all(self):
+        """Reload the users and the channels
+
+        return              True if both were reloaded
+        """
+        users_reloaded = await self.reload_users_cache()
+        channels_reloaded = await self.reload_channels_cache()
+        self.full_reloads += 1
+        if users_reloaded and channels_reloaded:
+            self.updated_at = time.time()
+        return users_reloaded and channels_reloaded
+
+    async def start(self, snapshot_path=None):
+        """Fill the cache, using the snapshot if there is one
+
+        snapshot_path       the path of the snapshot file (default: None, no snapshot)
+
+        If the snapshot can be loaded, this returns right away and the cache is refreshed
+        and saved in the background. Otherwise this returns once the cache is fetched.
+        """
+        if snapshot_path is not None and self.load_snapshot(snapshot_path):
+            tornado.ioloop.IOLoop.current().spawn_callback(self._refresh, snapshot_path)
+        else:
+            await self._refresh(snapshot_path)
 
-    @tornado.gen.coroutine
-    def fetch_all(self):
-        yield self.reload_users_cache()
-        yield self.reload_channels_cache()
+    def load_snapshot(self, path):
+        """Load a snapshot saved by save_snapshot
 
-    def stop():
+        return              True if the snapshot was loaded
+        """
+        if not os.path.exists(path):
+            return False
+        try:
+            connection = sqlite3.connect(path)
+            try:
+                meta = dict(connection.execute("SELECT key, value FROM meta"))
+                if int(meta.get("version", 0)) != Cache.SNAPSHOT_VERSION:
+                    logging.info("Ignoring snapshot {0}, version {1}".format(path, meta.get("version")))
+                    return False
+                users = connection.execute("SELECT {0} FROM users".format(
+                    ", ".join(UserRecord.__slots__))).fetchall()
+                channels = connection.execute("SELECT {0} FROM channels".format(
+                    ", ".join(ChannelRecord.__slots__))).fetchall()
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            logging.warning("Fail to load snapshot {0}: {1}".format(path, e))
+            return False
+
+        user_records = user_directory()
+        for row in users:
+            user_records.add(UserRecord(*row))
+        channel_records = channel_directory()
+        for row in channels:
+            channel_records.add(ChannelRecord(*row))
+        # swap everything at once
+        self.users = user_records
+        self.channels = channel_records
+        self.updated_at = float(meta["saved_at"])
+        return True
+
+    async def save_snapshot(self, path):
+        """Save the cache to a snapshot file
+
+        The file is written in a thread and then moved in place, so a crash never leaves a
+        partial snapshot behind.
+        """
+        users = [ tuple(getattr(user, field) for field in UserRecord.__slots__) for user in self.users ]
+        channels = [ tuple(getattr(channel, field) for field in ChannelRecord.__slots__)
+                for channel in self.channels ]
+        saved_at = self.updated_at if self.updated_at is not None else time.time()
+        await tornado.ioloop.IOLoop.current().run_in_executor(None, self._write_snapshot,
+                path, users, channels, saved_at)
+
+    @staticmethod
+    def _write_snapshot(path, users, channels, saved_at):
+        tmp_path = "{0}.tmp".format(path)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        try:
+            connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            connection.execute("CREATE TABLE users ({0})".format(", ".join(UserRecord.__slots__)))
+            connection.execute("CREATE TABLE channels ({0})".format(", ".join(ChannelRecord.__slots__)))
+            connection.executemany("INSERT INTO meta VALUES (?, ?)", [
+                ("version", str(Cache.SNAPSHOT_VERSION)), ("saved_at", repr(saved_at)) ])
+            connection.executemany("INSERT INTO users VALUES ({0})".format(
+                ", ".join("?" * len(UserRecord.__slots__))), users)
+            connection.executemany("INSERT INTO channels VALUES ({0})".format(
+                ", ".join("?" * len(ChannelRecord.__slots__))), channels)
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(tmp_path, path)
+
+    async def _refresh(self, snapshot_path):
+        await self.fetch_all()
+        if snapshot_path is not None and self.updated_at is not None:
+            try:
+                await self.save_snapshot(snapshot_path)
+            except (OSError, sqlite3.Error) as e:
+                logging.warning("Fail to save snapshot {0}: {1}".format(snapshot_path, e))
+
+    def stop(self):
         self.autofetch_enabled = False
 
+    async def _fetch_user(self, id):
+        # the user may have been added while the id was waiting for its batch
+        user = self.users.get(id)
+        if user is not None:
+            return user
+        response = await self.slack.api.users.info(user=id)
+        if response.code == 200 and response.data.error == "user_not_found":
+            return None
+        if response.code != 200 or not response.data.ok:
+            # i.e. 429, 5xx or ratelimited, the user may exist
+            raise RestAPIRuntimeException("users.info failed, Code: {0}, Error: {1}".format(
+                response.code, response.data.error if response.code == 200 else None))
+        user = UserRecord.from_member(response.data.user)
+        self.users.add(user)
+        return user
+
+    async def _fetch_channel(self, id):
+        channel = self.channels.get(id)
+        if channel is not None:
+            return channel
+        response = await self.slack.api.conversations.info(channel=id)
+        if response.code == 200 and response.data.error == "channel_not_found":
+            return None
+        if response.code != 200 or not response.data.ok:
+            raise RestAPIRuntimeException("conversations.info failed, Code: {0}, Error: {1}".format(
+                response.code, response.data.error if response.code == 200 else None))
+        # direct messages have no name, they are not cached
+        if not response.data.channel.get("name"):
+            return None
+        channel = ChannelRecord.from_channel(response.data.channel)
+        self.channels.add(channel)
+        return channel
+
+    def _set_channel(self, channel, is_member=None):
+        old = self.channels.get(channel["id"])
+        record = ChannelRecord.from_channel(channel)
+        if is_member is not None:
+            record.is_member = is_member
+        elif old is not None:
+            record.is_member = old.is_member
+        self.channels.add(record)
+
+    def _on_channel_created(self, event):
+        self._set_channel(event["channel"])
+        self.events_applied += 1
+
+    def _on_channel_rename(self, event):
+        self._set_channel(event["channel"])
+        self.events_applied += 1
+
+    def _on_channel_deleted(self, event):
+        self.channels.remove(event["channel"])
+        self.events_applied += 1
+
+    def _on_channel_joined(self, event):
+        self._set_channel(event["channel"], is_member=True)
+        self.events_applied += 1
+
+    def _on_channel_left(self, event):
+        channel = self.channels.get(event["channel"])
+        if channel is not None:
+            channel.is_member = False
+        self.events_applied += 1
+
+    def _on_user_change(self, event):
+        self.users.add(UserRecord.from_member(event["user"]))
+        self.events_applied += 1
+
+
+class Resolver(object):
+    """Fetch the ids missing from the cache, see Cache.resolve_user
+
+    fetch               a coroutine function, fetch(id) -> the record or None if it is not found,
+                        raising if the fetch failed
+    batch_delay         the time to wait for other ids before fetching (in seconds)
+    missing_ttl         the time to remember that an id cannot be found (in seconds)
+
+    Concurrent resolves of the same id share a single fetch. The ids requested during
+    batch_delay are fetched together, so a burst of messages from new users is sent as one
+    round of requests, paced by the rate limiter of the api. The ids that are not found are
+    not fetched again for missing_ttl seconds, so unknown ids cannot flood the api. The ids
+    whose fetch failed (i.e. timeout, 429) resolve to None but are fetched again next time.
+    """
+
+    # purge the expired missing ids when there are more than this
+    MAX_MISSING = 10000
+
+    def __init__(self, fetch, batch_delay=0.05, missing_ttl=60):
+        self.fetch = fetch
+        self.batch_delay = batch_delay
+        self.missing_ttl = missing_ttl
+        self._pending = {} # id -> Future, waiting for the next batch
+        self._inflight = {} # id -> Future, being fetched
+        self._missing = {} # id -> expiry (time.monotonic())
+        self._batch_scheduled = False
+
+        # stats
+        self.fetched = 0
+        self.not_found = 0
+        self.failed = 0
+        self.shared = 0
+        self.missing_hits = 0
+        self.batches = 0
+
+    def resolve(self, id):
+        """Resolve an id
+
+        return              a Future of the record, or of None if the id cannot be found
+        """
+        expiry = self._missing.get(id)
+        if expiry is not None:
+            if expiry > time.monotonic():
+                self.missing_hits += 1
+                future = tornado.concurrent.Future()
+                future.set_result(None)
+                return future
+            del self._missing[id]
+
+        future = self._pending.get(id) or self._inflight.get(id)
+        if future is not None:
+            self.shared += 1
+        else:
+            future = self._pending[id] = tornado.concurrent.Future()
+            if not self._batch_scheduled:
+                self._batch_scheduled = True
+                tornado.ioloop.IOLoop.current().call_later(self.batch_delay, self._fetch_batch)
+        # each caller gets its own future, cancelling it must not cancel the fetch of the other callers
+        return asyncio.shield(future)
+
+    def forget(self, id=None):
+        """Forget that an id cannot be found, or all of them if id is None"""
+        if id is None:
+            self._missing.clear()
+        else:
+            self._missing.pop(id, None)
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "inflight": len(self._inflight),
+            "missing": len(self._missing),
+            "fetched": self.fetched,
+            "not_found": self.not_found,
+            "failed": self.failed,
+            "shared": self.shared,
+            "missing_hits": self.missing_hits,
+            "batches": self.batches,
+        }
+
+    def _fetch_batch(self):
+        self._batch_scheduled = False
+        batch, self._pending = self._pending, {}
+        self._inflight.update(batch)
+        self.batches += 1
+        if len(self._missing) > self.MAX_MISSING:
+            now = time.monotonic()
+            self._missing = { id: expiry for id, expiry in self._missing.items() if expiry > now }
+        for id, future in batch.items():
+            tornado.ioloop.IOLoop.current().spawn_callback(self._fetch_one, id, future)
+
+    async def _fetch_one(self, id, future):
+        try:
+            record = await self.fetch(id)
+        except Exception as e:
+            logging.warning("Fail to resolve {0}: {1}".format(id, e))
+            # not remembered as missing, a transient failure must not hide an existing id
+            self.failed += 1
+            record = None
+        else:
+            self.fetched += 1
+            if record is None:
+                self.not_found += 1
+                self._missing[id] = time.monotonic() + self.missing_ttl
+        self._inflight.pop(id, None)
+        if not future.done():
+            future.set_result(record)
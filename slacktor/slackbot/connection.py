@@ -0,0 +1,199 @@
+
+import re
+import json
+import time
+import inspect
+import logging
+
+import tornado.gen
+import tornado.ioloop
+import tornado.websocket
+
+from ..api_wrapper import RetryPolicy, json_loads
+
+# {"type": "...", at the start of a frame, slack always sends the type first
+FRAME_TYPE_REGEX = re.compile(r'\A\s*\{\s*"type"\s*:\s*"([^"\\]*)"')
+
+
+def sniff_frame_type(frame):
+    """Read the type of a frame without parsing it
+
+    return              the type, or None if the frame does not start with its type
+    """
+    found = FRAME_TYPE_REGEX.match(frame) if isinstance(frame, str) else None
+    return found.group(1) if found is not None else None
+
+
+class RTMConnection(object):
+    """A rtm websocket that reconnects by itself
+
+    slack               the Slack object
+    retry_policy        the backoff between connection attempts
+                        (default: RetryPolicy(base_delay=1, max_delay=60))
+    ping_interval       send a ping every {ping_interval} seconds, 0 to disable (default: 30)
+    ping_timeout        reconnect if a ping is not answered within {ping_timeout} seconds
+                        (default: 2 * ping_interval)
+    on_reconnect        a function or coroutine called after reconnecting, before any frame
+                        from the new connection is returned (default: None)
+
+    The connection is replaced when the socket is closed, when a ping is not answered and
+    when reconnect is called (i.e. on goodbye).
+    """
+
+    def __init__(self, slack, retry_policy=None, ping_interval=30, ping_timeout=None, on_reconnect=None):
+        self.slack = slack
+        self.retry_policy = retry_policy or RetryPolicy(base_delay=1, max_delay=60)
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout if ping_timeout is not None else 2 * ping_interval
+        self.on_reconnect = on_reconnect
+        self.websocket = None
+        self.closed = False
+        self.connected_at = None
+        self._pinger = None
+        self._ping_id = 0
+        self._pings = {} # id -> time sent
+
+        # stats
+        self.reconnects = 0
+        self.failed_connects = 0
+        self.pings_sent = 0
+        self.pongs_received = 0
+        self.pings_missed = 0
+        self.last_rtt = None
+        self.total_rtt = 0.0
+
+    @property
+    def uptime(self):
+        """The time since the current connection was opened (in seconds), 0 if not connected"""
+        return time.monotonic() - self.connected_at if self.connected_at is not None else 0
+
+    async def connect(self):
+        """Open the websocket, retrying with backoff until it succeeds or close is called
+
+        return              True if connected
+        """
+        connected = await self._open()
+        if connected:
+            self._start_pinger()
+        return connected
+
+    async def _open(self):
+        attempt = 0
+        while not self.closed:
+            attempt += 1
+            try:
+                response = await self.slack.api.rtm.connect()
+                if response.code == 200 and response.data.ok:
+                    self.websocket = await tornado.websocket.websocket_connect(response.data.url)
+                    self.connected_at = time.monotonic()
+                    self._pings.clear()
+                    return True
+                logging.warning("rtm.connect failed, Code: {0}, Error: {1}".format(
+                    response.code, response.data.error if response.code == 200 else None))
+            except Exception as e:
+                import traceback; traceback.print_exc()
+            self.failed_connects += 1
+            delay = self.retry_policy.backoff(attempt)
+            logging.info("Reconnecting in {0:.1f}s".format(delay))
+            await tornado.gen.sleep(delay)
+        return False
+
+    async def read_message(self):
+        """Read the next frame, reconnecting if the connection is lost
+
+        return              the raw frame, or None once close is called
+        """
+        while not self.closed:
+            if self.websocket is None:
+                await self._reconnect()
+                continue
+            frame = await self.websocket.read_message()
+            if frame is None:
+                if not self.closed:
+                    logging.info("rtm connection lost, reconnecting")
+                self._disconnected()
+                continue
+            if sniff_frame_type(frame) == "pong":
+                self._on_pong(frame)
+                continue
+            return frame
+        return None
+
+    def reconnect(self):
+        """Replace the current connection, the next read_message will reconnect"""
+        if self.websocket is not None:
+            self.websocket.close()
+
+    def close(self):
+        """Close the connection for good, read_message will return None"""
+        self.closed = True
+        if self.websocket is not None:
+            self.websocket.close()
+        self._disconnected()
+
+    def stats(self):
+        return {
+            "connected": self.websocket is not None,
+            "uptime": self.uptime,
+            "reconnects": self.reconnects,
+            "failed_connects": self.failed_connects,
+            "pings_sent": self.pings_sent,
+            "pongs_received": self.pongs_received,
+            "pings_missed": self.pings_missed,
+            "last_rtt": self.last_rtt,
+            "avg_rtt": self.total_rtt / self.pongs_received if self.pongs_received else None,
+        }
+
+    async def _reconnect(self):
+        self.reconnects += 1
+        connected = await self._open()
+        if connected and self.on_reconnect is not None:
+            try:
+                result = self.on_reconnect()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                import traceback; traceback.print_exc()
+        # the pongs are only read by read_message, so the pings start once on_reconnect is done
+        if connected and self.websocket is not None:
+            self._start_pinger()
+
+    def _disconnected(self):
+        self.websocket = None
+        self.connected_at = None
+        if self._pinger is not None:
+            self._pinger.stop()
+            self._pinger = None
+
+    def _start_pinger(self):
+        if self.ping_interval and self._pinger is None:
+            self._pinger = tornado.ioloop.PeriodicCallback(self._ping, self.ping_interval * 1000)
+            self._pinger.start()
+
+    def _ping(self):
+        if self.websocket is None:
+            return
+        now = time.monotonic()
+        if self._pings and now - min(self._pings.values()) > self.ping_timeout:
+            logging.warning("rtm ping not answered after {0}s, reconnecting".format(self.ping_timeout))
+            self.pings_missed += len(self._pings)
+            self._pings.clear()
+            self.reconnect()
+            return
+        self._ping_id += 1
+        try:
+            self.websocket.write_message(json.dumps({ "id": self._ping_id, "type": "ping" }))
+        except tornado.websocket.WebSocketClosedError:
+            return
+        self._pings[self._ping_id] = now
+        self.pings_sent += 1
+
+    def _on_pong(self, frame):
+        try:
+            sent_at = self._pings.pop(json_loads(frame).get("reply_to"), None)
+        except ValueError:
+            return
+        if sent_at is not None:
+            self.pongs_received += 1
+            self.last_rtt = time.monotonic() - sent_at
+            self.total_rtt += self.last_rtt
@@ -0,0 +1,217 @@
+
+import sys
+import bisect
+import collections.abc
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _lower(value):
+    """Lower case value, reusing value when it is already lower case"""
+    if not value:
+        return None
+    lowered = value.lower()
+    return value if lowered == value else lowered
+
+
+class UserRecord(object):
+    """A slack user, only the fields that are used for lookups are kept"""
+
+    __slots__ = ("id", "name", "real_name", "display_name", "email", "is_bot", "deleted")
+
+    def __init__(self, id, name, real_name=None, display_name=None, email=None, is_bot=False, deleted=False):
+        self.id = _intern(id)
+        self.name = _intern(name)
+        self.real_name = real_name or None
+        self.display_name = display_name or None
+        self.email = email or None
+        self.is_bot = bool(is_bot)
+        self.deleted = bool(deleted)
+
+    @classmethod
+    def from_member(cls, member):
+        """Create the record from a member of users.list, users.info or the user of an event"""
+        profile = member.get("profile") or {}
+        return cls(member["id"], member["name"], real_name=member.get("real_name") or profile.get("real_name"),
+                display_name=profile.get("display_name"), email=profile.get("email"),
+                is_bot=member.get("is_bot"), deleted=member.get("deleted"))
+
+    def __repr__(self):
+        return "UserRecord({0!r}, {1!r})".format(self.id, self.name)
+
+
+class ChannelRecord(object):
+    """A slack channel, only the fields that are used for lookups are kept"""
+
+    __slots__ = ("id", "name", "is_member", "is_archived", "is_private")
+
+    def __init__(self, id, name, is_member=False, is_archived=False, is_private=False):
+        self.id = _intern(id)
+        self.name = _intern(name)
+        self.is_member = bool(is_member)
+        self.is_archived = bool(is_archived)
+        self.is_private = bool(is_private)
+
+    @classmethod
+    def from_channel(cls, channel):
+        """Create the record from a channel of channels.list, conversations.info or an event"""
+        return cls(channel["id"], channel["name"], is_member=channel.get("is_member"),
+                is_archived=channel.get("is_archived"),
+                is_private=channel.get("is_private") or channel.get("is_group"))
+
+    def __repr__(self):
+        return "ChannelRecord({0!r}, {1!r})".format(self.id, self.name)
+
+
+class Directory(object):
+    """Records stored once and indexed by id and by other keys
+
+    indexes             { index_name: function(record) -> key }, the key can be None
+    search_key          the index used by search, its keys must be lower case
+                        (default: None, search is disabled)
+
+    Secondary indexes map each key to a single record, the last one added wins if 2 records
+    have the same key. The records must not be modified while they are in the directory,
+    except for the fields that are not indexed.
+    """
+
+    def __init__(self, indexes, search_key=None):
+        self.index_keys = indexes
+        self.search_key = search_key
+        self.by_id = {}
+        self.indexes = { name: {} for name in indexes }
+        # sorted search keys and their records, built by the first search and then kept
+        # up to date by add and remove
+        self._sorted_keys = None
+        self._sorted_records = None
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+    def __contains__(self, id):
+        return id in self.by_id
+
+    def get(self, id):
+        return self.by_id.get(id)
+
+    def find(self, index, key):
+        """Find a record using a secondary index"""
+        return self.indexes[index].get(key)
+
+    def add(self, record):
+        """Add a record, replacing the record with the same id"""
+        old = self.by_id.get(record.id)
+        if old is not None:
+            self._unindex(old)
+        self.by_id[record.id] = record
+        for name, get_key in self.index_keys.items():
+            key = get_key(record)
+            if key is not None:
+                self.indexes[name][key] = record
+                if name == self.search_key:
+                    self._set_sorted(key, record)
+        return old
+
+    def remove(self, id):
+        record = self.by_id.pop(id, None)
+        if record is not None:
+            self._unindex(record)
+        return record
+
+    def search(self, prefix, limit=10):
+        """Find the records whose search key starts with prefix, i.e. for autocomplete"""
+        if self._sorted_keys is None:
+            index = self.indexes[self.search_key]
+            self._sorted_keys = sorted(index)
+            self._sorted_records = [ index[key] for key in self._sorted_keys ]
+        prefix = prefix.lower()
+        found = []
+        position = bisect.bisect_left(self._sorted_keys, prefix)
+        while position < len(self._sorted_keys) and len(found) < limit:
+            if not self._sorted_keys[position].startswith(prefix):
+                break
+            found.append(self._sorted_records[position])
+            position += 1
+        return found
+
+    def _unindex(self, record):
+        for name, get_key in self.index_keys.items():
+            key = get_key(record)
+            index = self.indexes[name]
+            if key is not None and index.get(key) is record:
+                del index[key]
+                if name == self.search_key:
+                    self._remove_sorted(key)
+
+    def _set_sorted(self, key, record):
+        if self._sorted_keys is None:
+            return
+        position = bisect.bisect_left(self._sorted_keys, key)
+        if position < len(self._sorted_keys) and self._sorted_keys[position] == key:
+            self._sorted_records[position] = record
+        else:
+            self._sorted_keys.insert(position, key)
+            self._sorted_records.insert(position, record)
+
+    def _remove_sorted(self, key):
+        if self._sorted_keys is None:
+            return
+        position = bisect.bisect_left(self._sorted_keys, key)
+        if position < len(self._sorted_keys) and self._sorted_keys[position] == key:
+            del self._sorted_keys[position]
+            del self._sorted_records[position]
+
+
+def user_directory():
+    return Directory({
+        "name": lambda user: user.name,
+        "lower_name": lambda user: _lower(user.name),
+        "display_name": lambda user: _lower(user.display_name),
+        "email": lambda user: _lower(user.email),
+    }, search_key="lower_name")
+
+
+def channel_directory():
+    return Directory({
+        "name": lambda channel: channel.name,
+        "lower_name": lambda channel: _lower(channel.name),
+    }, search_key="lower_name")
+
+
+class FieldView(collections.abc.Mapping):
+    """A read only mapping of an index of a directory to a field of the records"""
+
+    def __init__(self, index, field):
+        self.index = index
+        self.field = field
+
+    def __getitem__(self, key):
+        return getattr(self.index[key], self.field)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class MemberView(collections.abc.Set):
+    """A read only set of the ids of the channels with is_member set"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __contains__(self, id):
+        record = self.directory.get(id)
+        return record is not None and record.is_member
+
+    def __iter__(self):
+        return (record.id for record in self.directory if record.is_member)
+
+    def __len__(self):
+        return sum(1 for record in self.directory if record.is_member)
@@ -0,0 +1,139 @@
+
+import time
+import inspect
+import collections
+
+import tornado.ioloop
+import tornado.queues
+
+
+class HandlerStats(object):
+    """Latency of a single handler"""
+
+    __slots__ = ("calls", "errors", "total_time", "max_time")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed, failed):
+        self.calls += 1
+        self.errors += 1 if failed else 0
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_time": self.total_time / self.calls if self.calls else 0.0,
+            "max_time": self.max_time,
+        }
+
+
+class EventDispatcher(object):
+    """Run event handlers outside of the websocket reader
+
+    get_handlers        a function that returns the list of (name, handler) for an event
+    workers             the number of handlers that can run at the same time (default: 4)
+    queue_size          the max number of events waiting in each queue (default: 1000)
+    ordered             if True, the events of a channel (or of a user for events without a
+                        channel) are all handled by the same worker, in the order they are
+                        received (default: True)
+
+    Handlers can be plain functions or coroutines. dispatch blocks when the queue is full,
+    which stops the reader from reading more events until the workers catch up.
+    Exceptions raised by a handler are printed and do not affect the other handlers.
+    """
+
+    def __init__(self, get_handlers, workers=4, queue_size=1000, ordered=True):
+        self.get_handlers = get_handlers
+        self.workers = workers
+        self.ordered = ordered
+        number_of_queues = workers if ordered else 1
+        self._queues = [ tornado.queues.Queue(maxsize=queue_size) for _ in range(number_of_queues) ]
+        self._started = False
+
+        # stats
+        self.dispatched = 0
+        self.handled = 0
+        self.total_wait = 0.0
+        self.handler_stats = collections.defaultdict(HandlerStats)
+
+    @property
+    def queue_depth(self):
+        """The number of events waiting to be handled"""
+        return sum(queue.qsize() for queue in self._queues)
+
+    def start(self):
+        """Start the workers, this is called on the first dispatch"""
+        if self._started:
+            return
+        self._started = True
+        io_loop = tornado.ioloop.IOLoop.current()
+        for index in range(self.workers):
+            io_loop.spawn_callback(self._work, self._queues[index % len(self._queues)])
+
+    async def dispatch(self, event):
+        """Queue an event for its handlers
+
+        This returns once the event is queued, not once it is handled.
+        """
+        handlers = self.get_handlers(event)
+        if not handlers:
+            return
+        self.start()
+        self.dispatched += 1
+        await self._get_queue(event).put((event, handlers, time.monotonic()))
+
+    async def join(self):
+        """Wait until all the queued events are handled"""
+        for queue in self._queues:
+            await queue.join()
+
+    def stats(self):
+        return {
+            "queued": self.queue_depth,
+            "dispatched": self.dispatched,
+            "handled": self.handled,
+            "avg_wait": self.total_wait / self.handled if self.handled else 0.0,
+            "handlers": { str(name): stats.as_dict() for name, stats in self.handler_stats.items() },
+        }
+
+    def _get_queue(self, event):
+        if len(self._queues) == 1:
+            return self._queues[0]
+        # events about the same channel, or else the same user, go to the same queue
+        key = event.get("channel")
+        if key is None:
+            key = event.get("user")
+        if isinstance(key, dict): # channel_created, user_change and similar events
+            key = key.get("id")
+        if key is None:
+            key = event.get("type")
+        return self._queues[hash(key) % len(self._queues)]
+
+    async def _work(self, queue):
+        while True:
+            event, handlers, queued_at = await queue.get()
+            try:
+                self.total_wait += time.monotonic() - queued_at
+                for name, handler in handlers:
+                    await self._run(name, handler, event)
+                self.handled += 1
+            finally:
+                queue.task_done()
+
+    async def _run(self, name, handler, event):
+        start = time.monotonic()
+        failed = False
+        try:
+            result = handler(event)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            failed = True
+            import traceback; traceback.print_exc()
+        self.handler_stats[name].record(time.monotonic() - start, failed)
@@ -0,0 +1,176 @@
+import hmac
+import time
+import hashlib
+import logging
+import collections
+
+import tornado.web
+import tornado.ioloop
+
+from ..api_wrapper import json_loads
+
+
+def verify_signature(signing_secret, timestamp, body, signature, max_age=300, now=None):
+    """Verify the signature of a request sent by slack
+
+    signing_secret      the signing secret of the slack app
+    timestamp           the X-Slack-Request-Timestamp header
+    body                the raw body of the request (bytes)
+    signature           the X-Slack-Signature header
+    max_age             the max age of the request (in seconds), older requests are rejected
+                        to prevent replays (default: 300)
+    now                 the current time (default: time.time())
+
+    see https://api.slack.com/authentication/verifying-requests-from-slack
+    """
+    if not timestamp or not signature:
+        return False
+    try:
+        age = abs((now if now is not None else time.time()) - int(timestamp))
+    except ValueError:
+        return False
+    if age > max_age:
+        return False
+    if isinstance(signing_secret, str):
+        signing_secret = signing_secret.encode("utf-8")
+    base = b"v0:" + timestamp.encode("utf-8") + b":" + body
+    expected = "v0=" + hmac.new(signing_secret, base, hashlib.sha256).hexdigest()
+    # compare bytes, compare_digest raises a TypeError on non ascii str
+    return hmac.compare_digest(expected.encode("ascii"), signature.encode("utf-8", "replace"))
+
+
+class EventDeduplicator(object):
+    """Remember the ids of the events received recently
+
+    max_entries         the max number of ids to remember (default: 10000)
+    ttl                 the time an id is remembered (in seconds) (default: 3600)
+
+    This only knows the events received by this process. When several replicas are behind
+    a load balancer, a retry can reach another replica; give the receivers a deduplicator
+    backed by a shared store instead, with the same seen method.
+    """
+
+    def __init__(self, max_entries=10000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._seen = collections.OrderedDict() # event id -> expiry (time.monotonic())
+
+    def seen(self, event_id):
+        """Record an event id
+
+        return              True if the id was already recorded
+        """
+        now = time.monotonic()
+        # the oldest ids are first, drop the expired ones
+        while self._seen:
+            oldest_id, expiry = next(iter(self._seen.items()))
+            if expiry > now:
+                break
+            del self._seen[oldest_id]
+        if event_id in self._seen:
+            return True
+        self._seen[event_id] = now + self.ttl
+        if len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+        return False
+
+
+class EventsAPIReceiver(object):
+    """Receive the events pushed by the slack Events API, as an alternative to the rtm websocket
+
+    bot                 the SlackBot, the events are handed to its listeners
+    signing_secret      the signing secret of the slack app
+    deduplicator        remembers the ids of the events received, see EventDeduplicator
+                        (default: None, a EventDeduplicator is created)
+    max_age             the max age of a request (in seconds) (default: 300)
+
+    Slack expects an answer within 3 seconds, so each event is acknowledged before it is
+    dispatched. Retries of an event that was already received are acknowledged and dropped.
+    The receiver keeps no other state, so several replicas of the bot can share the load.
+
+        receiver = EventsAPIReceiver(bot, signing_secret)
+        receiver.application().listen(3000)
+
+    or add receiver.handlers() to an existing tornado application.
+    """
+
+    def __init__(self, bot, signing_secret, deduplicator=None, max_age=300):
+        self.bot = bot
+        self.signing_secret = signing_secret
+        self.deduplicator = deduplicator if deduplicator is not None else EventDeduplicator()
+        self.max_age = max_age
+
+        # stats
+        self.received = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self.retries = 0
+
+    def handlers(self, path="/slack/events"):
+        """The handlers to add to a tornado application"""
+        return [ (path, EventsAPIHandler, { "receiver": self }) ]
+
+    def application(self, path="/slack/events", **settings):
+        """A tornado application serving only the receiver"""
+        return tornado.web.Application(self.handlers(path), **settings)
+
+    def verify(self, timestamp, body, signature):
+        return verify_signature(self.signing_secret, timestamp, body, signature, max_age=self.max_age)
+
+    def receive(self, payload, retry_num=None):
+        """Dispatch the event of an event_callback payload, unless it was already received
+
+        return              True if the event is dispatched
+        """
+        self.received += 1
+        if retry_num is not None:
+            self.retries += 1
+        event_id = payload.get("event_id")
+        if event_id is not None and self.deduplicator.seen(event_id):
+            self.duplicates += 1
+            return False
+        event = payload.get("event")
+        if not isinstance(event, dict):
+            return False
+        tornado.ioloop.IOLoop.current().spawn_callback(self.bot.dispatch_event, event)
+        return True
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "rejected": self.rejected,
+            "duplicates": self.duplicates,
+            "retries": self.retries,
+        }
+
+
+class EventsAPIHandler(tornado.web.RequestHandler):
+    """The request handler of EventsAPIReceiver"""
+
+    def initialize(self, receiver):
+        self.receiver = receiver
+
+    def post(self):
+        receiver = self.receiver
+        headers = self.request.headers
+        if not receiver.verify(headers.get("X-Slack-Request-Timestamp"), self.request.body,
+                headers.get("X-Slack-Signature")):
+            receiver.rejected += 1
+            raise tornado.web.HTTPError(401)
+        try:
+            payload = json_loads(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        if not isinstance(payload, dict):
+            raise tornado.web.HTTPError(400)
+
+        payload_type = payload.get("type")
+        if payload_type == "url_verification":
+            self.finish({ "challenge": payload.get("challenge") })
+            return
+        # acknowledge first, the event is handled after the response is sent
+        self.finish()
+        if payload_type == "event_callback":
+            receiver.receive(payload, retry_num=headers.get("X-Slack-Retry-Num"))
+        else:
+            logging.info("Ignoring events api payload of type {0}".format(payload_type))
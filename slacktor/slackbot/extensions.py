@@ -2,14 +2,27 @@
 import re
 import uuid
 import logging
+import collections
 
 class Extension(object):
+    """
+    slackbot            the SlackBot, needed for the cpu bound listeners (default: None)
+    """
 
-    def __init__(self):
+    def __init__(self, slackbot=None):
+        self.slackbot = slackbot
         self.listeners = {}
 
-    def add_listener(self, func, name=None):
+    def add_listener(self, func, name=None, cpu_bound=False):
+        """
+        cpu_bound           if True, func runs in a worker process of the slackbot and what it
+                            returns is posted, see SlackBot.run_in_process (default: False)
+        """
         name = name or uuid.uuid4()
+        if cpu_bound:
+            if self.slackbot is None:
+                raise ValueError("cpu bound listeners need the slackbot of the extension")
+            func = self.slackbot.run_in_process(func)
         self.listeners[name] = func
 
     def remove_listener(self, name):
@@ -26,7 +39,7 @@ class Extension(object):
 class OnMentionExtension(Extension):
 
     def __init__(self, slackbot, user_id):
-        super().__init__()
+        super().__init__(slackbot)
         self.regex = re.compile("(?P<user>\<@{user}\>)".format(user=user_id))
         self.user_id = user_id
 
@@ -45,3 +58,213 @@ class OnMentionExtension(Extension):
         except Exception as e:
             import traceback; traceback.print_exc()
 
+
+
+RouteMatch = collections.namedtuple("RouteMatch", ("kind", "route", "start", "end", "args", "match"))
+RouteMatch.__doc__ = """A message matched by a route of the RouterExtension
+
+kind                "command", "prefix", "keyword" or "regex"
+route               the command, prefix, keyword or pattern that was registered
+start, end          the position of the match in the text
+args                the text after the command or prefix, None for keyword and regex
+match               the re match object of the route, only for regex
+"""
+
+
+class RouterExtension(Extension):
+    """Route messages to handlers
+
+    command_prefixes    the prefixes of commands (default: ("!", ))
+    case_sensitive      if False, commands, prefixes and keywords ignore case (default: False)
+    slackbot            the SlackBot, needed for the cpu bound listeners (default: None)
+
+    Routes can be
+        commands        "!deploy prod ...", one or more words after a command prefix
+        prefixes        any text starting with a prefix, i.e. ">>"
+        keywords        a single word anywhere in the text
+        regexes         any regex
+
+    All the routes are compiled into one matcher: a trie of words for the commands, a trie of
+    characters for the prefixes and a dict for the keywords, so their cost does not depend on
+    the number of routes. The regexes are also joined into one alternation regex, which is
+    only used to skip the messages that no regex route can match; the routes of the other
+    messages are searched one by one, so for them the cost grows linearly with the number of
+    regex routes. Prefer commands, prefixes and keywords when there are many routes.
+
+    Handlers are called with (event, user_id, channel_id, match), where match is a RouteMatch.
+    Each route that matches is called once per message. The listeners added with add_listener
+    are called for every match.
+    """
+
+    WORD_REGEX = re.compile(r"\w+")
+    TOKEN_REGEX = re.compile(r"\S+")
+    BACKREFERENCE_REGEX = re.compile(r"\\[1-9]")
+
+    def __init__(self, command_prefixes=("!", ), case_sensitive=False, slackbot=None):
+        super().__init__(slackbot)
+        self.command_prefixes = tuple(command_prefixes)
+        self.case_sensitive = case_sensitive
+        self.routes = {} # name -> (kind, route, func)
+        self._compiled = False
+
+    def add_command(self, command, func, name=None):
+        """Route "{prefix}{command} args" to func, command can be multiple words"""
+        if not command.split():
+            raise ValueError("command cannot be empty")
+        return self._add_route("command", command, func, name)
+
+    def add_prefix(self, prefix, func, name=None):
+        """Route any text starting with prefix to func"""
+        if not prefix:
+            raise ValueError("prefix cannot be empty")
+        return self._add_route("prefix", prefix, func, name)
+
+    def add_keyword(self, keyword, func, name=None):
+        """Route any text containing the word keyword to func"""
+        if not RouterExtension.WORD_REGEX.fullmatch(keyword):
+            raise ValueError("keyword must be a single word, use add_regex instead: {0}".format(keyword))
+        return self._add_route("keyword", keyword, func, name)
+
+    def add_regex(self, pattern, func, name=None):
+        """Route any text matching the regex pattern to func"""
+        re.compile(pattern) # fail early on invalid pattern
+        return self._add_route("regex", pattern, func, name)
+
+    def remove_route(self, name):
+        self._compiled = False
+        return self.routes.pop(name, None)
+
+    def compile(self):
+        """Compile the routes into the matcher
+
+        This is done automatically on the first message after the routes are changed.
+        """
+        self._commands = {}
+        self._prefixes = {}
+        self._keywords = {}
+        regexes = []
+        for name, (kind, route, func) in self.routes.items():
+            if kind == "command":
+                node = self._commands
+                for word in self._normalize(route).split():
+                    node = node.setdefault(word, {})
+                node.setdefault(None, []).append((route, func))
+            elif kind == "prefix":
+                node = self._prefixes
+                for char in self._normalize(route):
+                    node = node.setdefault(char, {})
+                node.setdefault(None, []).append((route, func))
+            elif kind == "keyword":
+                self._keywords.setdefault(self._normalize(route), []).append((route, func))
+            else:
+                regexes.append((route, func))
+
+        self._regexes = [ (route, re.compile(route), func) for route, func in regexes ]
+        self._combined_regex = None
+        # numbered back-references refer to other groups once the patterns are joined
+        if regexes and not any(RouterExtension.BACKREFERENCE_REGEX.search(route) for route, _ in regexes):
+            try:
+                self._combined_regex = re.compile("|".join("(?:{0})".format(route)
+                        for route, _ in regexes))
+            except re.error:
+                # i.e. the same group name used in 2 patterns, each regex is searched every time
+                logging.warning("Fail to combine the regex routes, they will be searched one by one")
+        self._compiled = True
+
+    def route(self, text):
+        """Find all the routes matching a text
+
+        return          a list of (func, RouteMatch)
+        """
+        if not self._compiled:
+            self.compile()
+        matched = []
+        self._match_commands(text, matched)
+        self._match_prefixes(text, matched)
+        self._match_keywords(text, matched)
+        self._match_regexes(text, matched)
+        return matched
+
+    def __call__(self, event):
+        try:
+            text = event.get("text")
+            if text is None:
+                return
+            for func, match in self.route(text):
+                kwargs = dict(event=event, user_id=event.get("user"), channel_id=event.get("channel"),
+                        match=match)
+                try:
+                    func(**kwargs)
+                except Exception as e:
+                    import traceback; traceback.print_exc()
+                self.fire(**kwargs)
+        except Exception as e:
+            import traceback; traceback.print_exc()
+
+    def _add_route(self, kind, route, func, name):
+        name = name or uuid.uuid4()
+        self.routes[name] = (kind, route, func)
+        self._compiled = False
+        return name
+
+    def _normalize(self, text):
+        return text if self.case_sensitive else text.lower()
+
+    def _match_commands(self, text, matched):
+        if not self._commands:
+            return
+        for prefix in self.command_prefixes:
+            if text.startswith(prefix):
+                break
+        else:
+            return
+        node = self._commands
+        found = None
+        for token in RouterExtension.TOKEN_REGEX.finditer(text, len(prefix)):
+            node = node.get(self._normalize(token.group()))
+            if node is None:
+                break
+            if None in node:
+                found = (node[None], token.end())
+        if found is not None:
+            routes, end = found
+            args = text[end:].strip()
+            for route, func in routes:
+                matched.append((func, RouteMatch("command", route, 0, end, args, None)))
+
+    def _match_prefixes(self, text, matched):
+        node = self._prefixes
+        found = None
+        for index, char in enumerate(text):
+            node = node.get(char if self.case_sensitive else char.lower())
+            if node is None:
+                break
+            if None in node:
+                found = (node[None], index + 1)
+        if found is not None:
+            routes, end = found
+            for route, func in routes:
+                matched.append((func, RouteMatch("prefix", route, 0, end, text[end:], None)))
+
+    def _match_keywords(self, text, matched):
+        if not self._keywords:
+            return
+        seen = set()
+        for word in RouterExtension.WORD_REGEX.finditer(text):
+            key = self._normalize(word.group())
+            routes = self._keywords.get(key)
+            if routes is None or key in seen:
+                continue
+            seen.add(key)
+            for route, func in routes:
+                matched.append((func, RouteMatch("keyword", route, word.start(), word.end(), None, None)))
+
+    def _match_regexes(self, text, matched):
+        if not self._regexes:
+            return
+        if self._combined_regex is not None and self._combined_regex.search(text) is None:
+            return
+        for route, regex, func in self._regexes:
+            found = regex.search(text)
+            if found:
+                matched.append((func, RouteMatch("regex", route, found.start(), found.end(), None, found)))
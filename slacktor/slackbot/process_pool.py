@@ -0,0 +1,102 @@
+import os
+import time
+import functools
+import collections
+import concurrent.futures
+
+import tornado.locks
+import tornado.ioloop
+
+from .dispatcher import HandlerStats
+from .extensions import RouteMatch
+
+
+class ProcessPool(object):
+    """Run cpu bound functions in worker processes, off the IOLoop thread
+
+    processes           the number of worker processes (default: None, the number of CPUs)
+    max_in_flight       the max number of calls sent to the processes at the same time, the
+                        other calls wait on the IOLoop (default: None, 2 per process)
+
+    The processes are started on the first call. The function and its args are pickled, so
+    the function must be defined at the top level of a module, and the args must be plain
+    data such as the event dicts (the re match of a RouteMatch is dropped, the rest of the
+    RouteMatch is sent). Its return value is pickled back to the IOLoop.
+    """
+
+    def __init__(self, processes=None, max_in_flight=None):
+        self.processes = processes or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or 2 * self.processes
+        self._executor = None
+        self._semaphore = tornado.locks.Semaphore(self.max_in_flight)
+
+        # stats
+        self.waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.function_stats = collections.defaultdict(HandlerStats)
+
+    async def run(self, func, *args, **kwargs):
+        """Call func(*args, **kwargs) in a worker process
+
+        return              the return value of func, or raise its exception
+        """
+        queued_at = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.monotonic()
+        self.total_wait += started - queued_at
+        self.max_wait = max(self.max_wait, started - queued_at)
+        self.in_flight += 1
+        failed = False
+        try:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.processes)
+            args = tuple(_picklable(arg) for arg in args)
+            kwargs = { key: _picklable(value) for key, value in kwargs.items() }
+            return await tornado.ioloop.IOLoop.current().run_in_executor(self._executor,
+                    functools.partial(func, *args, **kwargs))
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.in_flight -= 1
+            self.completed += 0 if failed else 1
+            self.failed += 1 if failed else 0
+            self.function_stats[_get_name(func)].record(time.monotonic() - started, failed)
+            self._semaphore.release()
+
+    def shutdown(self, wait=True):
+        """Stop the worker processes, they are started again by the next call"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def stats(self):
+        calls = self.completed + self.failed
+        return {
+            "processes": self.processes,
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait": self.total_wait / calls if calls else 0.0,
+            "max_wait": self.max_wait,
+            "functions": { name: stats.as_dict() for name, stats in self.function_stats.items() },
+        }
+
+
+def _picklable(value):
+    if isinstance(value, RouteMatch) and value.match is not None:
+        return value._replace(match=None)
+    return value
+
+
+def _get_name(func):
+    return "{0}.{1}".format(getattr(func, "__module__", None), getattr(func, "__qualname__", repr(func)))
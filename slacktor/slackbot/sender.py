@@ -0,0 +1,144 @@
+import time
+import logging
+import collections
+
+import tornado.gen
+import tornado.ioloop
+import tornado.concurrent
+
+
+class _Outgoing(object):
+    """A message waiting to be posted, with the futures of the messages merged into it"""
+
+    __slots__ = ("params", "futures")
+
+    def __init__(self, params, future):
+        self.params = params
+        self.futures = [ future ]
+
+
+class MessageSender(object):
+    """Post messages with chat.postMessage, in order and at the pace allowed by slack
+
+    slack               the Slack object
+    interval            the min time between 2 posts to the same channel (in seconds) (default: 1)
+    coalesce            if True, consecutive text only messages waiting for the same channel
+                        and thread are merged into a single post (default: True)
+    max_text_length     the max length of a merged text (default: 4000)
+    separator           the separator between merged texts (default: "\\n")
+
+    Each channel (and thread) has its own FIFO queue, and a message is only posted once the
+    previous message of the queue is posted, so retries cannot reorder the messages.
+    The threads of a channel share the pace of the channel.
+    """
+
+    def __init__(self, slack, interval=1.0, coalesce=True, max_text_length=4000, separator="\n"):
+        self.slack = slack
+        self.interval = interval
+        self.coalesce = coalesce
+        self.max_text_length = max_text_length
+        self.separator = separator
+        self._queues = {} # (channel, thread_ts) -> deque of _Outgoing
+        self._next_post = {} # channel -> the time (time.monotonic()) of the next allowed post
+
+        # stats
+        self.queued = 0
+        self.posts = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def send(self, channel, text=None, thread_ts=None, **params):
+        """Queue a message
+
+        params              the other params of chat.post_message
+
+        return              a future of the response of the post that included the message.
+                            If the post fails, the exception is set on the future.
+        """
+        params["channel"] = channel
+        if text is not None:
+            params["text"] = text
+        if thread_ts is not None:
+            params["thread_ts"] = thread_ts
+        future = tornado.concurrent.Future()
+        self.queued += 1
+
+        key = (channel, thread_ts)
+        queue = self._queues.get(key)
+        if queue is not None:
+            if self.coalesce and self._merge(queue[-1], params, future, is_head=len(queue) == 1):
+                return future
+            queue.append(_Outgoing(params, future))
+            return future
+
+        self._queues[key] = collections.deque([ _Outgoing(params, future) ])
+        tornado.ioloop.IOLoop.current().spawn_callback(self._post_queue, key)
+        return future
+
+    def backlog(self):
+        """The number of posts waiting, per channel or channel/thread_ts"""
+        return {
+            channel if thread_ts is None else "{0}/{1}".format(channel, thread_ts): len(queue)
+            for (channel, thread_ts), queue in self._queues.items()
+        }
+
+    def stats(self):
+        return {
+            "queued": self.queued,
+            "posts": self.posts,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+            "backlog": self.backlog(),
+        }
+
+    _TEXT_ONLY_PARAMS = frozenset(("channel", "text", "thread_ts"))
+
+    def _merge(self, outgoing, params, future, is_head):
+        # the head of the queue may already be posting
+        if is_head or "text" not in params or "text" not in outgoing.params:
+            return False
+        # only text only messages are merged, the other params (attachments, blocks, ...) would be lost
+        if not set(params) <= self._TEXT_ONLY_PARAMS or not set(outgoing.params) <= self._TEXT_ONLY_PARAMS:
+            return False
+        text = outgoing.params["text"] + self.separator + params["text"]
+        if len(text) > self.max_text_length:
+            return False
+        outgoing.params["text"] = text
+        outgoing.futures.append(future)
+        self.coalesced += 1
+        return True
+
+    async def _post_queue(self, key):
+        channel = key[0]
+        queue = self._queues[key]
+        while queue:
+            outgoing = queue[0]
+            # take the next slot of the channel
+            now = time.monotonic()
+            post_at = max(now, self._next_post.get(channel, 0))
+            self._next_post[channel] = post_at + self.interval
+            if post_at > now:
+                await tornado.gen.sleep(post_at - now)
+
+            try:
+                try:
+                    response = await self.slack.api.chat.post_message(**outgoing.params)
+                except Exception as e:
+                    logging.warning("Fail to post to {0}: {1}".format(channel, e))
+                    self.failed += 1
+                    for future in outgoing.futures:
+                        # the caller may have cancelled it (e.g. a timeout)
+                        if not future.done():
+                            future.set_exception(e)
+                            future.exception() # already logged, do not log it again if nobody waits for it
+                else:
+                    self.posts += 1
+                    for future in outgoing.futures:
+                        if not future.done():
+                            future.set_result(response)
+            finally:
+                queue.popleft()
+        del self._queues[key]
+        # the slots in the past are not needed anymore
+        if self._next_post.get(channel, 0) < time.monotonic():
+            self._next_post.pop(channel, None)
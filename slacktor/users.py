@@ -7,14 +7,29 @@ _API = {
     "list": {
         "url": "/api/users.list",
         "method": "GET",
+        "rate_tier": 2,
         "params": {
             "token": { "type": "string", "is_required": True },
             "presence": { "type": "bool_string" },
+            "cursor": { "type": "string" },
+            "limit": { "type": "int" },
         },
+        "pagination": { "type": "cursor", "items": "members", "page_size": 200 },
         "parse_data": ("members", )
     },
+    "info": {
+        "url": "/api/users.info",
+        "method": "GET",
+        "rate_tier": 4,
+        "params": {
+            "token": { "type": "string", "is_required": True },
+            "user": { "type": "string", "is_required": True },
+            "include_locale": { "type": "bool_string" },
+        },
+        "parse_data": ("user", )
+    },
 }
 class UsersAPI(_GenericAPI):
 
-    def __init__(self, token):
-        super().__init__(token, _API)
+    def __init__(self, token, http_client=None):
+        super().__init__(token, _API, http_client=http_client)
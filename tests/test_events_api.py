@@ -0,0 +1,113 @@
+import hmac
+import json
+import time
+import hashlib
+
+import tornado.gen
+import tornado.ioloop
+import tornado.testing
+import tornado.httpserver
+import tornado.httpclient
+
+from slacktor.slackbot.events_api import EventsAPIReceiver, verify_signature
+
+SIGNING_SECRET = "test-signing-secret"
+
+
+def run(coroutine_function):
+    return tornado.ioloop.IOLoop.current().run_sync(coroutine_function)
+
+
+def sign(body, timestamp, signing_secret=SIGNING_SECRET):
+    return "v0=" + hmac.new(signing_secret.encode("utf-8"), b"v0:" + timestamp.encode("utf-8") + b":" + body,
+            hashlib.sha256).hexdigest()
+
+
+class Bot(object):
+    """Records the events dispatched by the receiver"""
+
+    def __init__(self):
+        self.events = []
+
+    async def dispatch_event(self, event):
+        self.events.append(event)
+
+
+def post(receiver, payload, timestamp=None, signature=None, retry_num=None):
+    """Post a payload to a receiver listening on a free port
+
+    return              the response
+    """
+    body = json.dumps(payload).encode("utf-8")
+    timestamp = timestamp if timestamp is not None else str(int(time.time()))
+    headers = { "Content-Type": "application/json", "X-Slack-Request-Timestamp": timestamp,
+            "X-Slack-Signature": signature if signature is not None else sign(body, timestamp) }
+    if retry_num is not None:
+        headers["X-Slack-Retry-Num"] = str(retry_num)
+
+    async def main():
+        sock, port = tornado.testing.bind_unused_port()
+        server = tornado.httpserver.HTTPServer(receiver.application())
+        server.add_sockets([ sock ])
+        try:
+            response = await tornado.httpclient.AsyncHTTPClient().fetch(
+                    "http://127.0.0.1:{0}/slack/events".format(port), method="POST", body=body,
+                    headers=headers, raise_error=False)
+            # let the receiver dispatch the event
+            await tornado.gen.sleep(0)
+            return response
+        finally:
+            server.stop()
+
+    return run(main)
+
+
+def test_valid_signature():
+    body = b'{"type":"event_callback"}'
+    assert verify_signature(SIGNING_SECRET, "1000", body, sign(body, "1000"), now=1000)
+
+
+def test_bad_signature():
+    body = b'{"type":"event_callback"}'
+    assert not verify_signature(SIGNING_SECRET, "1000", body, sign(body, "1000", "other-secret"), now=1000)
+    assert not verify_signature(SIGNING_SECRET, "1000", body + b" ", sign(body, "1000"), now=1000)
+    assert not verify_signature(SIGNING_SECRET, "1000", body, None, now=1000)
+
+
+def test_stale_timestamp():
+    body = b'{"type":"event_callback"}'
+    assert not verify_signature(SIGNING_SECRET, "1000", body, sign(body, "1000"), max_age=300, now=1301)
+    assert verify_signature(SIGNING_SECRET, "1000", body, sign(body, "1000"), max_age=300, now=1300)
+
+
+def test_non_ascii_signature():
+    assert not verify_signature(SIGNING_SECRET, "1000", b"{}", "v0=é", now=1000)
+
+
+def test_bad_signature_is_rejected():
+    bot = Bot()
+    receiver = EventsAPIReceiver(bot, SIGNING_SECRET)
+    payload = { "type": "event_callback", "event_id": "Ev1", "event": { "type": "message" } }
+    assert post(receiver, payload, signature="v0=bad").code == 401
+    assert post(receiver, payload, signature="v0=é").code == 401
+    assert post(receiver, payload, timestamp=str(int(time.time()) - 3600)).code == 401
+    assert receiver.stats()["rejected"] == 3
+    assert bot.events == []
+
+
+def test_url_verification_echoes_the_challenge():
+    receiver = EventsAPIReceiver(Bot(), SIGNING_SECRET)
+    response = post(receiver, { "type": "url_verification", "challenge": "abc123" })
+    assert response.code == 200
+    assert json.loads(response.body) == { "challenge": "abc123" }
+
+
+def test_duplicate_event_is_dropped():
+    bot = Bot()
+    receiver = EventsAPIReceiver(bot, SIGNING_SECRET)
+    payload = { "type": "event_callback", "event_id": "Ev1", "event": { "type": "message", "text": "hi" } }
+    assert post(receiver, payload).code == 200
+    assert post(receiver, payload, retry_num=1).code == 200
+    assert bot.events == [ { "type": "message", "text": "hi" } ]
+    assert receiver.stats()["duplicates"] == 1
+    assert receiver.stats()["retries"] == 1
@@ -0,0 +1,37 @@
+import asyncio
+
+import tornado.ioloop
+import tornado.concurrent
+
+from slacktor.api_wrapper import HTTPClientPool
+
+
+class PendingHTTPClient(object):
+    """Never answer"""
+
+    def fetch(self, request, raise_error=True, **kwargs):
+        return tornado.concurrent.Future()
+
+    def close(self):
+        pass
+
+
+def test_cancelled_while_queued_releases_the_host_slot():
+    pool = HTTPClientPool(http_client=PendingHTTPClient(), max_concurrency=1, max_per_host=2)
+
+    async def main():
+        # holds the only global slot
+        first = asyncio.ensure_future(pool.fetch("http://slack.test/api/a"))
+        await asyncio.sleep(0)
+        # takes the second host slot, then waits for the global slot
+        second = asyncio.ensure_future(pool.fetch("http://slack.test/api/b"))
+        await asyncio.sleep(0)
+        second.cancel()
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        host_semaphore = pool._get_host_semaphore("slack.test")
+        assert host_semaphore._value == 2
+        assert pool._semaphore._value == 1
+
+    tornado.ioloop.IOLoop.current().run_sync(main)
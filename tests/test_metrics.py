@@ -0,0 +1,15 @@
+from slacktor.api_wrapper import APIMetrics
+
+
+def test_prometheus_histogram_buckets():
+    metrics = APIMetrics(buckets=(0.1, 1.0))
+    metrics.endpoint("/api/users.info").record_call(tries=1, call_time=0.5, failed=False)
+    lines = metrics.render_prometheus().splitlines()
+    buckets = [ line for line in lines if line.startswith("slacktor_api_call_seconds_bucket") ]
+    assert buckets == [
+        'slacktor_api_call_seconds_bucket{endpoint="/api/users.info",le="0.1"} 0',
+        'slacktor_api_call_seconds_bucket{endpoint="/api/users.info",le="1.0"} 1',
+        'slacktor_api_call_seconds_bucket{endpoint="/api/users.info",le="+Inf"} 1',
+    ]
+    assert 'slacktor_api_call_seconds_count{endpoint="/api/users.info"} 1' in lines
+    assert 'slacktor_api_call_seconds_sum{endpoint="/api/users.info"} 0.5' in lines
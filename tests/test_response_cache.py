@@ -0,0 +1,71 @@
+import asyncio
+
+import tornado.ioloop
+
+from slacktor.api_wrapper import RestAPI, ResponseCache
+
+
+def run(coroutine_function):
+    return tornado.ioloop.IOLoop.current().run_sync(coroutine_function)
+
+
+class Response(object):
+    code = 500
+
+
+def answered_after(event):
+    async def fetch():
+        await event.wait()
+        return Response()
+    return fetch
+
+
+def test_key_does_not_depend_on_params_order():
+    for method in (RestAPI.GET, RestAPI.POST):
+        api = RestAPI.from_config({ "url": "/api/users.list", "method": method, "host": "slack.test",
+            "params": { "a": { "type": "int" }, "b": { "type": "string" } } })
+        first = api.request(a=1, b="x")
+        second = api.request(b="x", a=1)
+        assert ResponseCache.key_for(first) == ResponseCache.key_for(second)
+
+
+def test_cancelled_first_caller_does_not_cancel_the_other_callers():
+    cache = ResponseCache()
+    answer = asyncio.Event()
+    answered = answered_after(answer)
+
+    async def main():
+        first = asyncio.ensure_future(cache.fetch("key", 60, answered))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.fetch("key", 60, answered))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        answer.set()
+        assert (await asyncio.wait_for(second, 1)).code == 500
+        assert first.cancelled()
+        assert cache.stats()["inflight"] == 0
+
+    run(main)
+
+
+def test_cancelled_waiter_does_not_cancel_the_shared_fetch():
+    cache = ResponseCache()
+    answer = asyncio.Event()
+    answered = answered_after(answer)
+
+    async def main():
+        first = asyncio.ensure_future(cache.fetch("key", 60, answered))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.fetch("key", 60, answered))
+        third = asyncio.ensure_future(cache.fetch("key", 60, answered))
+        await asyncio.sleep(0)
+        second.cancel()
+        await asyncio.sleep(0)
+        answer.set()
+        assert (await first).code == 500
+        assert (await third).code == 500
+        assert second.cancelled()
+        assert cache.stats()["inflight"] == 0
+
+    run(main)
@@ -0,0 +1,51 @@
+import io
+
+import pytest
+import tornado.ioloop
+import tornado.httputil
+import tornado.httpclient
+import tornado.concurrent
+
+from slacktor.api_wrapper import (TokenBucket, RetryPolicy, RestAPIDeadlineExceeded,
+        fetch_with_retries)
+
+
+class RateLimitedHTTPClient(object):
+    """Answer every request with a 429"""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        self.fetched = 0
+
+    def fetch(self, request, raise_error=True, **kwargs):
+        self.fetched += 1
+        headers = tornado.httputil.HTTPHeaders({ "Retry-After": str(self.retry_after) })
+        future = tornado.concurrent.Future()
+        future.set_result(tornado.httpclient.HTTPResponse(request, 429, headers=headers,
+            buffer=io.BytesIO(b""), request_time=0))
+        return future
+
+
+def fetch(http_client, **kwargs):
+    request = tornado.httpclient.HTTPRequest("http://slack.test/api/users.info")
+    return tornado.ioloop.IOLoop.current().run_sync(
+        lambda: fetch_with_retries(http_client, request, **kwargs))
+
+
+def test_last_try_429_pauses_the_bucket():
+    bucket = TokenBucket(100, 10)
+    response = fetch(RateLimitedHTTPClient(30), max_tries=1, rate_limiter=bucket)
+    assert response.code == 429
+    stats = bucket.stats()
+    assert stats["rate_limited"] == 1
+    assert stats["paused_for"] > 29
+
+
+def test_429_beyond_the_deadline_pauses_the_bucket():
+    bucket = TokenBucket(100, 10)
+    with pytest.raises(RestAPIDeadlineExceeded):
+        fetch(RateLimitedHTTPClient(30), max_tries=3, rate_limiter=bucket,
+                retry_policy=RetryPolicy(deadline=5))
+    stats = bucket.stats()
+    assert stats["rate_limited"] == 1
+    assert stats["paused_for"] > 29
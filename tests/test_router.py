@@ -0,0 +1,45 @@
+from slacktor.slackbot.extensions import RouterExtension
+
+
+def matched_routes(router, text):
+    return sorted(match.route for _, match in router.route(text))
+
+
+def test_overlapping_regex_routes_all_match():
+    router = RouterExtension()
+    for pattern in ("deploy", r"deploy \w+", "prod"):
+        router.add_regex(pattern, lambda **kwargs: None)
+    assert matched_routes(router, "deploy prod") == sorted([ "deploy", r"deploy \w+", "prod" ])
+
+
+def test_regex_route_groups_are_its_own():
+    router = RouterExtension()
+    router.add_regex(r"(\w+)@(\w+)", lambda **kwargs: None)
+    router.add_regex(r"deploy (?P<env>\w+)", lambda **kwargs: None)
+    matches = { match.route: match.match for _, match in router.route("deploy prod as bob@ops") }
+    assert matches[r"(\w+)@(\w+)"].groups() == ("bob", "ops")
+    assert matches[r"deploy (?P<env>\w+)"].group("env") == "prod"
+
+
+def test_regex_route_with_backreference():
+    router = RouterExtension()
+    router.add_regex(r"(a)x", lambda **kwargs: None)
+    router.add_regex(r"(b)\1", lambda **kwargs: None)
+    assert matched_routes(router, "bb") == [ r"(b)\1" ]
+    assert matched_routes(router, "ax bb") == sorted([ r"(a)x", r"(b)\1" ])
+
+
+def test_regex_routes_not_matching():
+    router = RouterExtension()
+    router.add_regex("deploy", lambda **kwargs: None)
+    router.add_regex("prod", lambda **kwargs: None)
+    assert router.route("nothing to see") == []
+
+
+def test_each_matching_route_is_called_once():
+    router = RouterExtension()
+    calls = []
+    router.add_regex("deploy", lambda match, **kwargs: calls.append(match.route))
+    router.add_regex(r"deploy \w+", lambda match, **kwargs: calls.append(match.route))
+    router({ "type": "message", "text": "deploy prod deploy staging", "user": "U1", "channel": "C1" })
+    assert sorted(calls) == sorted([ "deploy", r"deploy \w+" ])